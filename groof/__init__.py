@@ -71,26 +71,196 @@
 ...     bytype.setmulti('knight', n2)
 >>> [n['name'] for n in bytype.getmulti('knight')]
 ['The Green Knight', 'The Black Knight']
+>>> # deleting a node hides its edges at once; a collector reclaims them later
+>>> with g:
+...     g[end.id].delete()
+>>> [n['name'] for n in traverser(lambda t: True, start, BFS, NEXT)]
+[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+>>> g.is_deleted(end.id)
+True
+>>> collector = EdgeCollector(g)
+>>> collector.run() # number of batches run
+1
+>>> collector.stats()['edges_reclaimed'], g.is_deleted(end.id)
+(10, False)
+>>> # adjacency lists of supernodes are packed into compressed segments
+>>> packed = graph('/tmp/grooftest-packed')
+>>> packed.adjacency.threshold, packed.adjacency.segment_size = 8, 4
+>>> unpacked = graph('/tmp/grooftest-unpacked')
+>>> def build(h):
+...     with h:
+...         hub = h.create_node()
+...         for i in range(40):
+...             spoke = h.create_node()
+...             _ = hub.edges.add(NEXT, spoke)
+...             _ = spoke.edges.add(NEXT, hub)
+...         _ = hub.edges.add(FOUGHT, spoke)
+>>> def drop_nodes(h):
+...     with h:
+...         for i in range(35, 42):
+...             h[i].delete()
+>>> def drop_edges(h):
+...     with h:
+...         for e in h[1].edges(NEXT)[:30]:
+...             e.remove()
+>>> def grow(h):
+...     with h:
+...         for i in range(5):
+...             _ = h.create_node().edges.add(NEXT, h[1])
+>>> def collect(h):
+...     _ = EdgeCollector(h).run()
+>>> def same(*changes):
+...     for f in changes:
+...         f(packed)
+...         f(unpacked)
+...     reads = lambda h: [(h.adjacent_edges(1, rel, d),
+...         h.adjacent_edges(1, rel, d, 5), h.degree(1, rel, d))
+...         for rel in (None, NEXT, FOUGHT) for d in (OUTGOING, INCOMING, BOTH)]
+...     return reads(packed) == reads(unpacked)
+>>> same(build), packed.adjacency.is_packed(1, NEXT, OUTGOING)
+(True, True)
+>>> unpacked.adjacency.is_packed(1, NEXT, OUTGOING)
+False
+>>> same(drop_nodes), same(collect), packed.degree(1, NEXT, INCOMING)
+(True, True, 33)
+>>> same(drop_edges), packed.adjacency.is_packed(1, NEXT, OUTGOING)
+(True, False)
+>>> same(grow), packed.degree(1, NEXT, INCOMING)
+(True, 38)
+>>> packed.adjacency.is_packed(1, NEXT, INCOMING)
+True
+>>> # a snapshot keeps reading the graph as of when it was taken
+>>> s = g.snapshot()
+>>> with g:
+...     n2['name'] = 'The Red Knight'
+>>> s[n2.id]['name'], g[n2.id]['name']
+('The Black Knight', 'The Red Knight')
+>>> s.release()
+>>> # large attribute values are stored apart and read when first accessed
+>>> with g:
+...     book = g.create_node(title='Gawain', text='x' * 10000)
+>>> with g: # only the small record is rewritten
+...     book['title'] = 'Sir Gawain and the Green Knight'
+>>> book = g[book.id]
+>>> book['title'], len(book['text']), len(g.storage.blobs)
+('Sir Gawain and the Green Knight', 10000, 1)
+>>> # dump a graph and restore it into an empty one
+>>> _ = g.dump('/tmp/grooftest.dump')
+>>> g2 = graph('/tmp/grooftest-restored')
+>>> g2.restore('/tmp/grooftest.dump') > 0
+True
+>>> len(g2) == len(g), g2[n1.id]['name'], len(g2[book.id]['text'])
+(True, 'The Green Knight', 10000)
+>>> [n['name'] for n in g2.get_index('bytype').getmulti('knight')]
+['The Green Knight', 'The Red Knight']
+>>> g2.close()
+>>> # cache traversal results until a commit changes what they read
+>>> cache = TraversalCache(g)
+>>> len(cache.traverse(start.id, BFS, NEXT)), len(cache.traverse(start.id, BFS, NEXT))
+(11, 11)
+>>> cache.stats()['hits']
+1
+>>> with g:
+...     _ = start.edges.add(NEXT, n1)
+>>> len(cache.traverse(start.id, BFS, NEXT)), cache.stats()['invalidations']
+(12, 1)
+>>> cache.close()
+>>> # query nodes by pattern; the planner picks where to start
+>>> q = query(g).node('k', index='bytype', key='knight').rel('k', FOUGHT, 'foe')
+>>> print q.explain()
+scan k: index bytype['knight'] (est. 2 rows)
+expand k -[1]-> foe using left store (est. 1 rows)
+est. cost 3
+>>> [(m['k']['name'], m['foe']['name']) for m in q]
+[('The Green Knight', 'The Red Knight')]
+>>> # shortest paths and k-hop neighborhoods read only node ids
+>>> shortest_path(start, n2)
+[3, 1, 2]
+>>> len(k_hop(start, 1)), len(k_hop(start, 2))
+(11, 12)
+>>> # traversals can go against edge direction, stop at a depth or prune
+>>> [n['name'] for n in traverser(lambda t: True, n2, BFS, direction=INCOMING)]
+['The Red Knight', 'The Green Knight', 0]
+>>> [n['name'] for n in traverser(lambda t: True, start, BFS)][-2:]
+[10, 'The Red Knight']
+>>> [n['name'] for n in traverser(lambda t: True, start, BFS, max_depth=1)][-2:]
+[9, 10]
+>>> [n['name'] for n in traverser(lambda t: True, start, BFS,
+...     prune=lambda t: t.node_id == n1.id)][-2:]
+[9, 10]
+>>> # checkpoint a traversal and resume it later
+>>> t = traverser(lambda t: True, start, BFS, NEXT)
+>>> [n['name'] for n, i in zip(t, range(4))]
+[0, 'The Green Knight', 1, 2]
+>>> state = t.checkpoint().dumps()
+>>> [n['name'] for n in traverser(lambda t: True, start, BFS, NEXT,
+...     state=loads_state(state))]
+[4, 5, 6, 7, 8, 9, 10]
+>>> # edges as (left id, rel, right id) rows instead of Edge objects
+>>> g.get_edges(FOUGHT, left=n1, rows='tuples')
+[(1, 1, 2)]
+>>> # count and time hot paths while instrumentation is enabled
+>>> from instrument import enable, disable, Stats
+>>> stats = Stats()
+>>> enable(stats)
+>>> g[n1.id]['name']
+'The Green Knight'
+>>> stats.ops['graph.get_node']['count']
+1
+>>> disable()
+>>> # seeded random walks come out the same every time
+>>> from walk import Walker
+>>> w = Walker(g, length=5, seed=7)
+>>> walks = [w.walk(start.id, n) for n in range(20)]
+>>> walks == [Walker(g, length=5, seed=7).walk(start.id, n) for n in range(20)]
+True
+>>> sorted(set([len(walk) for walk in walks]))
+[2]
 """
 
 from __future__ import with_statement
-from graph import Graph, INCOMING, OUTGOING
-from traverse import TraverserGenerator, DFS, BFS
-from storage.tc import TokyoCabinetStorageGroup
+from graph import Graph, INCOMING, OUTGOING, BOTH
+from traverse import (
+    TraverserGenerator, DFS, BFS, shortest_path, k_hop, load_state, loads_state
+)
+from query import Query
+from idset import IdSet
+from collector import EdgeCollector
+from pool import GraphPool
+from client import RemoteGraph
+from cache import TraversalCache
 
 
-__all__ = ['graph', 'traverser', 'INCOMING', 'OUTGOING', 'DFS', 'BFS']
+__all__ = ['graph', 'traverser', 'query', 'shortest_path', 'k_hop',
+    'load_state', 'loads_state', 'IdSet', 'EdgeCollector', 'GraphPool',
+    'RemoteGraph', 'TraversalCache',
+    'INCOMING', 'OUTGOING', 'BOTH', 'DFS', 'BFS']
 
 
-def graph(path):
-    storage = TokyoCabinetStorageGroup(path)
-    return Graph(storage)
+def graph(path, backend='tc', readonly=False):
+    """Open the graph stored at path. backend is 'tc' for tokyo cabinet or
+    'sqlite'. A readonly graph can't be saved, but can be opened by several
+    processes at once."""
+    if backend == 'tc':
+        from storage.tc import TokyoCabinetStorageGroup as storage_factory
+    elif backend == 'sqlite':
+        from storage.sqlite import SQLiteStorageGroup as storage_factory
+    else:
+        raise ValueError, "Unknown storage backend: %s" % backend
+    return Graph(storage_factory(path, readonly=readonly))
     
     
-def traverser(traversal_evaluator, start_node, traversal_algorithm, rel=None):
-    return TraverserGenerator(traversal_evaluator, start_node, traversal_algorithm, rel)
+def traverser(traversal_evaluator, start_node, traversal_algorithm, rel=None,
+        direction=OUTGOING, max_depth=None, max_fanout=None, prune=None,
+        state=None):
+    return TraverserGenerator(traversal_evaluator, start_node, traversal_algorithm,
+        rel, direction, max_depth, max_fanout, prune, state)
     
     
+def query(graph):
+    return Query(graph)
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
\ No newline at end of file
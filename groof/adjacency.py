@@ -0,0 +1,267 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Adjacency lists with packed segments for supernodes
+
+Every edge has a record in the left store keyed by (left id, rel, right id)
+holding its attributes, and an empty inverted record in the right store. Once
+a node has more than PACK_THRESHOLD edges of one rel in one direction, the
+neighbor ids for that (node, rel, direction) are also written to the adjacency
+store as delta encoded, compressed segments of at most SEGMENT_SIZE ids, keyed
+by (node id, rel, direction, first id in segment). Reads of a packed adjacency
+list then touch a few segment records instead of one record per edge.
+
+The left store stays complete since it holds edge attributes. The right store
+only holds the inverted records of adjacency lists that are not packed.
+"""
+
+import struct
+import zlib
+from bisect import bisect_right
+from keys import (
+    OUTGOING, INCOMING, EDGE_KEY_PREFIX_FORMAT, pack_node_key, unpack_node_key,
+    pack_edge_key, unpack_edge_key, invert_edge_key, pack_edge_key_prefix
+)
+from idset import pack_id_deltas, unpack_id_deltas
+
+
+PACK_THRESHOLD = 1000
+SEGMENT_SIZE = 4096
+SEGMENT_PREFIX_SIZE = struct.calcsize(EDGE_KEY_PREFIX_FORMAT) + 1
+MAX_REL = 0xffffffff
+
+
+def pack_segment_prefix(node_id, rel, direction):
+    return pack_edge_key_prefix(node_id, rel) + chr(direction)
+    
+    
+def pack_segment_key(node_id, rel, direction, first_id):
+    return pack_segment_prefix(node_id, rel, direction) + pack_node_key(first_id)
+    
+    
+def unpack_segment_key(k):
+    node_id, rel = struct.unpack(EDGE_KEY_PREFIX_FORMAT, k[:SEGMENT_PREFIX_SIZE-1])
+    return (node_id, rel, ord(k[SEGMENT_PREFIX_SIZE-1]),
+        unpack_node_key(k[SEGMENT_PREFIX_SIZE:]))
+        
+        
+def pack_segment(ids):
+    return struct.pack('>I', len(ids)) + zlib.compress(pack_id_deltas(ids))
+    
+    
+def unpack_segment(s):
+    return unpack_id_deltas(zlib.decompress(s[4:]))
+    
+    
+def segment_length(s):
+    return struct.unpack('>I', s[:4])[0]
+
+
+
+class Adjacency(object):
+    """Read and maintain the adjacency lists of a storage group"""
+    
+    def __init__(self, storage, threshold=PACK_THRESHOLD, segment_size=SEGMENT_SIZE):
+        self.storage = storage
+        self.threshold = threshold
+        self.segment_size = segment_size
+        
+        
+    def edges(self, node_id, rel, direction, limit=-1):
+        """Get (left_id, rel, right_id) tuples for the edges of node_id in one
+        direction, in (rel, neighbor id) order"""
+        if rel is not None:
+            if self.is_packed(node_id, rel, direction):
+                return self._segment_edges(node_id, rel, direction, limit)
+            return self._record_edges(
+                direction, pack_edge_key_prefix(node_id, rel), limit)
+        packed = self.packed_rels(node_id, direction)
+        if not packed:
+            return self._record_edges(direction, pack_node_key(node_id), limit)
+        # Read the records between packed rels with range scans so the records
+        # of packed rels are skipped without being read
+        edges = []
+        start = pack_node_key(node_id)
+        for r in packed:
+            edges.extend(self._range_edges(direction, start,
+                pack_edge_key_prefix(node_id, r), _remaining(limit, edges)))
+            edges.extend(self._segment_edges(
+                node_id, r, direction, _remaining(limit, edges)))
+            if len(edges) == limit or r == MAX_REL:
+                return edges
+            start = pack_edge_key_prefix(node_id, r+1)
+        edges.extend(self._range_edges(direction, start,
+            pack_node_key(node_id+1), _remaining(limit, edges)))
+        return edges
+        
+        
+    def count(self, node_id, rel, direction, limit=-1):
+        if rel is not None and self.is_packed(node_id, rel, direction):
+            n = sum([segment_length(self.storage.adjacency[k]) for k in
+                self.storage.adjacency.match_prefix(
+                    pack_segment_prefix(node_id, rel, direction))])
+            return n if limit < 0 else min(n, limit)
+        if rel is None and self.packed_rels(node_id, direction):
+            return len(self.edges(node_id, rel, direction, limit))
+        return len(self._store(direction).match_prefix(
+            pack_edge_key_prefix(node_id, rel), limit))
+            
+            
+    def is_packed(self, node_id, rel, direction):
+        if len(self.storage.adjacency) == 0:
+            return False
+        return len(self.storage.adjacency.match_prefix(
+            pack_segment_prefix(node_id, rel, direction), 1)) > 0
+            
+            
+    def packed_rels(self, node_id, direction):
+        """Get the sorted rels for which node_id has packed segments"""
+        if len(self.storage.adjacency) == 0:
+            return []
+        rels = []
+        for k in self.storage.adjacency.match_prefix(pack_node_key(node_id)):
+            n, rel, d, first_id = unpack_segment_key(k)
+            if d == direction and (not rels or rels[-1] != rel):
+                rels.append(rel)
+        return rels
+        
+        
+    def apply(self, added, removed):
+        """Update adjacency lists for added and removed edges, given as
+        (left_id, rel, right_id) tuples. The left store must already have been
+        updated. Adjacency lists that grow past the threshold are packed and
+        packed lists that shrink below half of it are unpacked."""
+        changes = {}
+        for i, edges in ((0, added), (1, removed)):
+            for (left_id, rel, right_id) in edges:
+                changes.setdefault((left_id, rel, OUTGOING), ([], []))[i].append(right_id)
+                changes.setdefault((right_id, rel, INCOMING), ([], []))[i].append(left_id)
+        for (node_id, rel, direction), (add, remove) in changes.items():
+            if self.is_packed(node_id, rel, direction):
+                self._update_segments(node_id, rel, direction, add, remove)
+                if self.count(node_id, rel, direction) < self.threshold / 2:
+                    self.unpack(node_id, rel, direction)
+                continue
+            if direction is INCOMING:
+                for other_id in remove:
+                    try:
+                        del self.storage.right[pack_edge_key(node_id, rel, other_id)]
+                    except KeyError:
+                        pass
+                for other_id in add:
+                    self.storage.right[pack_edge_key(node_id, rel, other_id)] = ''
+            if add and len(self._store(direction).match_prefix(
+                pack_edge_key_prefix(node_id, rel), self.threshold+1)) > self.threshold:
+                self.pack(node_id, rel, direction)
+                
+                
+    def pack(self, node_id, rel, direction):
+        prefix = pack_edge_key_prefix(node_id, rel)
+        keys = self._store(direction).match_prefix(prefix)
+        ids = [unpack_edge_key(k)[2] for k in keys]
+        self._write_segments(node_id, rel, direction, ids)
+        if direction is INCOMING:
+            for k in keys:
+                del self.storage.right[k]
+                
+                
+    def unpack(self, node_id, rel, direction):
+        prefix = pack_segment_prefix(node_id, rel, direction)
+        for k in self.storage.adjacency.match_prefix(prefix):
+            if direction is INCOMING:
+                for other_id in unpack_segment(self.storage.adjacency[k]):
+                    self.storage.right[pack_edge_key(node_id, rel, other_id)] = ''
+            del self.storage.adjacency[k]
+            
+            
+    def _store(self, direction):
+        if direction is OUTGOING:
+            return self.storage.left
+        elif direction is INCOMING:
+            return self.storage.right
+        raise ValueError, "Unknown direction: %s" % direction
+        
+        
+    def _keys_to_edges(self, direction, keys):
+        if direction is OUTGOING:
+            return [unpack_edge_key(k) for k in keys]
+        return [unpack_edge_key(invert_edge_key(k)) for k in keys]
+        
+        
+    def _record_edges(self, direction, prefix, limit):
+        if limit == 0:
+            return []
+        return self._keys_to_edges(direction,
+            self._store(direction).match_prefix(prefix, limit))
+            
+            
+    def _range_edges(self, direction, start, stop, limit):
+        if limit == 0:
+            return []
+        return self._keys_to_edges(direction,
+            self._store(direction).range(start, stop, limit))
+            
+            
+    def _segment_edges(self, node_id, rel, direction, limit):
+        ids = []
+        for k in self.storage.adjacency.match_prefix(
+            pack_segment_prefix(node_id, rel, direction)):
+            if limit == 0 or len(ids) == limit:
+                break
+            ids.extend(unpack_segment(self.storage.adjacency[k]))
+        if limit >= 0:
+            ids = ids[:limit]
+        if direction is OUTGOING:
+            return [(node_id, rel, other_id) for other_id in ids]
+        return [(other_id, rel, node_id) for other_id in ids]
+        
+        
+    def _update_segments(self, node_id, rel, direction, add, remove):
+        keys = self.storage.adjacency.match_prefix(
+            pack_segment_prefix(node_id, rel, direction))
+        firsts = [unpack_segment_key(k)[3] for k in keys]
+        groups = {}
+        for i, ids in ((0, add), (1, remove)):
+            for other_id in ids:
+                j = max(0, bisect_right(firsts, other_id) - 1)
+                groups.setdefault(j, ([], []))[i].append(other_id)
+        for j, (add, remove) in groups.items():
+            ids = set(unpack_segment(self.storage.adjacency[keys[j]]))
+            ids.update(add)
+            ids.difference_update(remove)
+            del self.storage.adjacency[keys[j]]
+            self._write_segments(node_id, rel, direction, sorted(ids))
+            
+            
+    def _write_segments(self, node_id, rel, direction, ids):
+        size = self.segment_size
+        if len(ids) > size:
+            size = max(1, size / 2)
+        for i in range(0, len(ids), size):
+            chunk = ids[i:i+size]
+            self.storage.adjacency[pack_segment_key(
+                node_id, rel, direction, chunk[0])] = pack_segment(chunk)
+                
+                
+                
+def _remaining(limit, items):
+    if limit < 0:
+        return limit
+    return limit - len(items)
\ No newline at end of file
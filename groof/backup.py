@@ -0,0 +1,346 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Dumps and restores of whole graphs
+
+A dump holds every record of every store and index of a graph as of one
+commit. It is read from a snapshot, so writers keep going while it runs.
+The first dump of a graph also starts its change journal (see mvcc), and
+later dumps may be incremental: they hold only the keys written since the
+previous dump, with their current values or as deleted.
+
+File format: a header (magic, version, kind, the generation the dump
+starts after and the generation it ends at), then blocks of zlib
+compressed records, each with its raw size and CRC-32, then an empty block
+and the number of records. A record is a store name switch or a key with
+its list of values; an empty list means the key was deleted.
+
+Records are written in key order, so restoring is a sorted bulk insert
+rather than a replay of the original writes. The whole file is checked
+before anything is written and then applied in one transaction, so a
+corrupt dump leaves the graph untouched.
+"""
+
+import os
+import struct
+import zlib
+from keys import META_KEY, unpack_meta
+from mvcc import unpack_journal_key
+
+
+MAGIC = 'GRBK'
+VERSION = 1
+FULL = 0
+INCREMENTAL = 1
+
+HEADER_FORMAT = '>4sBBII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+BLOCK_HEADER_FORMAT = '>III'
+BLOCK_HEADER_SIZE = struct.calcsize(BLOCK_HEADER_FORMAT)
+
+STORE_RECORD = 1
+KEY_RECORD = 2
+
+# Raw bytes compressed per block
+BLOCK_SIZE = 1 << 20
+
+# Consumed journal keys deleted per transaction
+JOURNAL_BATCH_SIZE = 10000
+
+# Journal record holding the generation a graph was last restored to
+RESTORED_KEY = 'r'
+
+
+class BackupError(Exception):
+    pass
+
+
+
+class DumpWriter(object):
+
+    def __init__(self, f, kind, since, generation):
+        self.f = f
+        self.count = 0
+        self._buf = []
+        self._size = 0
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, kind, since, generation))
+        
+        
+    def store(self, name):
+        self._add(struct.pack('>BH', STORE_RECORD, len(name)) + name)
+        
+        
+    def key(self, k, values):
+        parts = [struct.pack('>BII', KEY_RECORD, len(k), len(values)), k]
+        for v in values:
+            parts.append(struct.pack('>I', len(v)))
+            parts.append(v)
+        self._add(''.join(parts))
+        self.count += 1
+        
+        
+    def close(self):
+        self._flush()
+        self.f.write(struct.pack(BLOCK_HEADER_FORMAT, 0, 0, 0))
+        self.f.write(struct.pack('>Q', self.count))
+        
+        
+    def _add(self, s):
+        self._buf.append(s)
+        self._size += len(s)
+        if self._size >= BLOCK_SIZE:
+            self._flush()
+            
+            
+    def _flush(self):
+        if not self._buf:
+            return
+        raw = ''.join(self._buf)
+        data = zlib.compress(raw)
+        self.f.write(struct.pack(BLOCK_HEADER_FORMAT, len(data), len(raw),
+            zlib.crc32(raw) & 0xFFFFFFFF))
+        self.f.write(data)
+        self._buf = []
+        self._size = 0
+
+
+
+class DumpReader(object):
+    """Read a dump. Iterating gives (store name, key, values) in file order
+    and checks every block and the record count."""
+    
+    def __init__(self, f):
+        self.f = f
+        header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise BackupError, "Truncated dump header"
+        magic, version, self.kind, self.since, self.generation = struct.unpack(
+            HEADER_FORMAT, header)
+        if magic != MAGIC:
+            raise BackupError, "Not a groof dump"
+        if version != VERSION:
+            raise BackupError, "Unsupported dump version %d" % version
+            
+            
+    def __iter__(self):
+        count = 0
+        store = None
+        for raw in self._blocks():
+            i = 0
+            while i < len(raw):
+                kind = ord(raw[i])
+                if kind == STORE_RECORD:
+                    n, = struct.unpack_from('>H', raw, i+1)
+                    store = raw[i+3:i+3+n]
+                    i += 3 + n
+                elif kind == KEY_RECORD:
+                    n, num_values = struct.unpack_from('>II', raw, i+1)
+                    i += 9
+                    k = raw[i:i+n]
+                    i += n
+                    values = []
+                    for j in xrange(num_values):
+                        n, = struct.unpack_from('>I', raw, i)
+                        values.append(raw[i+4:i+4+n])
+                        i += 4 + n
+                    count += 1
+                    yield store, k, values
+                else:
+                    raise BackupError, "Unknown record type %d" % kind
+        trailer = self.f.read(8)
+        if len(trailer) < 8 or struct.unpack('>Q', trailer)[0] != count:
+            raise BackupError, "Dump is truncated"
+            
+            
+    def _blocks(self):
+        while True:
+            header = self.f.read(BLOCK_HEADER_SIZE)
+            if len(header) < BLOCK_HEADER_SIZE:
+                raise BackupError, "Dump is truncated"
+            size, raw_size, crc = struct.unpack(BLOCK_HEADER_FORMAT, header)
+            if size == 0:
+                return
+            data = self.f.read(size)
+            if len(data) < size:
+                raise BackupError, "Dump is truncated"
+            try:
+                raw = zlib.decompress(data)
+            except zlib.error:
+                raw = None
+            if raw is None or len(raw) != raw_size or \
+                    zlib.crc32(raw) & 0xFFFFFFFF != crc:
+                raise BackupError, "Checksum mismatch, the dump is corrupt"
+            yield raw
+            
+            
+            
+def _store_names(storage):
+    names = [n for n in storage.storage_attrs if n != 'journal']
+    return names + ['index:' + n for n in storage.index_names()]
+    
+    
+def _get_store(storage, name):
+    if name.startswith('index:'):
+        return storage.get_index(name[6:])
+    if name not in storage.storage_attrs or name == 'journal':
+        raise BackupError, "Unknown store %s" % name
+    return getattr(storage, name)
+    
+    
+def dump(graph, path, incremental=False):
+    """Write a dump of graph to path. An incremental dump holds the changes
+    since the previous dump. Returns the number of keys written."""
+    versioned = graph.storage
+    since = versioned.log.generation
+    if incremental and since is None:
+        raise BackupError, "An incremental dump needs a previous dump"
+    # Start the next generation at the same commit as the snapshot
+    graph._write_lock.acquire()
+    try:
+        generation = versioned.begin_generation()
+        snapshot = graph.snapshot()
+    finally:
+        graph._write_lock.release()
+    try:
+        if incremental:
+            journal_keys = versioned.journal_keys(generation)
+        tmp_path = path + '.tmp'
+        f = open(tmp_path, 'wb')
+        try:
+            w = DumpWriter(f, INCREMENTAL if incremental else FULL,
+                since or 0, generation)
+            if incremental:
+                _dump_changes(snapshot.storage, w, journal_keys)
+            else:
+                _dump_all(snapshot.storage, w)
+            w.close()
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+    finally:
+        snapshot.release()
+    # The changes are in this dump (or in the full dump), so forget them
+    if not incremental:
+        journal_keys = versioned.journal_keys(generation)
+    _delete(graph, versioned.group.journal, journal_keys)
+    return w.count
+    
+    
+def _dump_all(storage, w):
+    for name in _store_names(storage):
+        w.store(name)
+        store = _get_store(storage, name)
+        for k in store:
+            w.key(k, store.getdup(k))
+            
+            
+def _dump_changes(storage, w, journal_keys):
+    changes = {}
+    for jk in journal_keys:
+        generation, name, k = unpack_journal_key(jk)
+        changes.setdefault(name, set()).add(k)
+    for name in sorted(changes):
+        w.store(name)
+        store = _get_store(storage, name)
+        for k in sorted(changes[name]):
+            try:
+                values = store.getdup(k)
+            except KeyError:
+                values = []
+            w.key(k, values)
+            
+            
+def _delete(graph, store, keys):
+    for i in xrange(0, len(keys), JOURNAL_BATCH_SIZE):
+        graph._write_lock.acquire()
+        try:
+            for k in keys[i:i+JOURNAL_BATCH_SIZE]:
+                del store[k]
+        finally:
+            graph._write_lock.release()
+            
+            
+def restore(graph, path):
+    """Load a dump into graph. A full dump needs an empty graph; incremental
+    dumps must be applied in the order they were made. Returns the number of
+    keys restored."""
+    f = open(path, 'rb')
+    try:
+        # Check every block and the record count before writing anything
+        names = set([name for name, k, values in DumpReader(f)])
+        f.seek(0)
+        r = DumpReader(f)
+        storage = graph.storage
+        # Open the indices first; some backends only take the indices that
+        # are already open into a transaction
+        for name in names:
+            if name.startswith('index:'):
+                storage.group.get_index(name[6:])
+        restored = storage.journal
+        if r.kind == FULL:
+            if len(graph) > 0 or len(storage.left) > 0:
+                raise BackupError, "Can't restore a full dump into a non-empty graph"
+        else:
+            last = struct.unpack('>I', restored[RESTORED_KEY])[0] \
+                if RESTORED_KEY in restored else None
+            if last != r.since:
+                raise BackupError, "Dump follows generation %d but the graph was "\
+                    "restored to %s" % (r.since, last)
+        graph._write_lock.acquire()
+        try:
+            graph.notify_begin()
+            try:
+                count = _restore(storage, r)
+            except:
+                graph.notify_abort()
+                raise
+        finally:
+            graph._write_lock.release()
+    finally:
+        f.close()
+    graph.last_node_id = graph.next_node_id = unpack_meta(storage.node[META_KEY])[1]
+    graph.load_tombstones()
+    graph.notify(None)
+    return count
+    
+    
+def _restore(storage, reader):
+    """Apply the records of reader and mark the graph as restored to its
+    generation, all in one transaction"""
+    count = 0
+    name = None
+    storage.start_txn()
+    try:
+        for store_name, k, values in reader:
+            if store_name != name:
+                name = store_name
+                store = _get_store(storage, name)
+            if k in store:
+                store.deldup(k)
+            for v in values:
+                store.setdup(k, v)
+            count += 1
+        storage.journal[RESTORED_KEY] = struct.pack('>I', reader.generation)
+        storage.commit_txn()
+    except:
+        storage.abort_txn()
+        raise
+    return count
\ No newline at end of file
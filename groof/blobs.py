@@ -0,0 +1,123 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Out-of-line storage of large node attribute values
+
+When a node is saved, any attribute value whose JSON encoding is longer than
+the graph's blob_threshold goes to the blobs store under the node's key plus
+the attribute name. The node record lists those names under BLOB_REFS_KEY.
+Loading a node creates a BlobRef for each listed name, and the value is only
+read when the attribute is accessed. A value that hasn't been reassigned is
+not written again, so updating a small attribute of a node with large ones
+only rewrites the small record.
+"""
+
+import cjson
+from keys import pack_node_key
+
+
+# Values whose encoding is longer than this many bytes are stored out of line
+BLOB_THRESHOLD = 4096
+
+# Key in a node record listing its out-of-line attributes
+BLOB_REFS_KEY = '\x00blobs'
+
+
+def pack_blob_key(node_id, name):
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return pack_node_key(node_id) + name
+
+
+
+class BlobRef(object):
+    """An attribute value in the blobs store, read on first access"""
+    
+    __slots__ = ('storage', 'key', 'value', 'loaded')
+    
+    def __init__(self, storage, key):
+        self.storage = storage
+        self.key = key
+        self.value = None
+        self.loaded = False
+        
+        
+    def load(self):
+        if not self.loaded:
+            self.value = cjson.decode(self.storage.blobs[self.key])
+            self.loaded = True
+        return self.value
+        
+        
+        
+def decode_attrs(storage, node_id, s):
+    """Decode a node record. Returns the attrs, with a BlobRef for each out of
+    line value, and the names of the out of line attributes."""
+    attrs = cjson.decode(s)
+    names = attrs.pop(BLOB_REFS_KEY, None)
+    if not names:
+        return attrs, ()
+    for name in names:
+        attrs[name] = BlobRef(storage, pack_blob_key(node_id, name))
+    return attrs, tuple(names)
+    
+    
+def encode_attrs(storage, node_id, attrs, old_names=(), threshold=BLOB_THRESHOLD):
+    """Encode a node record, writing large values to the blobs store. Blobs of
+    old_names that were removed or now fit inline are deleted. Returns the
+    record and the names of the out of line attributes. Values written out of
+    line are replaced in attrs by a loaded BlobRef, so saving again does not
+    rewrite them unless they are reassigned."""
+    items = []
+    names = []
+    for k, v in attrs.items():
+        if not isinstance(k, basestring):
+            raise cjson.EncodeError, "JSON encodable dict objects can only have string keys"
+        if v.__class__ is BlobRef:
+            if v.key == pack_blob_key(node_id, k):
+                # Unchanged since it was loaded
+                names.append(k)
+                continue
+            v = v.load()
+        s = cjson.encode(v)
+        if threshold is not None and len(s) > threshold:
+            ref = BlobRef(storage, pack_blob_key(node_id, k))
+            storage.blobs[ref.key] = s
+            ref.value = v
+            ref.loaded = True
+            attrs[k] = ref
+            names.append(k)
+        else:
+            items.append('%s:%s' % (cjson.encode(k), s))
+    if names:
+        items.append('%s:%s' % (cjson.encode(BLOB_REFS_KEY), cjson.encode(names)))
+    for name in old_names:
+        if name not in names:
+            k = pack_blob_key(node_id, name)
+            if k in storage.blobs:
+                del storage.blobs[k]
+    return '{%s}' % ','.join(items), tuple(names)
+    
+    
+def delete_blobs(storage, node_id):
+    """Delete all the out of line values of a node"""
+    for k in storage.blobs.match_prefix(pack_node_key(node_id)):
+        del storage.blobs[k]
\ No newline at end of file
@@ -0,0 +1,353 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Cached traversal and query results
+
+A TraversalCache keeps the results of repeated reads, such as traversals
+from the same start node with the same rels and depth, and drops them when
+a commit changes what they read. Each result is computed against a
+TrackingGraph, which records the nodes and the (node, rel, direction)
+adjacency prefixes read through it. The cache listens to the commits made
+by Graph.save and the edge collector and drops exactly the results whose
+reads intersect the commit's changes. A result is not cached if a commit
+started or ended while it was computed, since it may have read writes that
+were not yet committed.
+
+    cache = TraversalCache(g, max_bytes=64 << 20)
+    ids = cache.traverse(start_id, BFS, FOLLOWS, max_depth=3)
+    near = cache.k_hop(start_id, 2, FOLLOWS)
+    names = cache.call(('names', start_id),
+        lambda g: [n['name'] for n in g[start_id].edges(FOLLOWS)])
+
+Results read with whole graph scans (node_ids, indices) are returned but
+not cached, since no commit can be checked against them. len() and stats()
+are not tracked; they are taken as estimates, as the query planner uses
+them. Writes that bypass Graph.save, such as index updates or a graph
+server's storage writes, are not seen by the cache.
+Cached results are shared between callers and must not be modified.
+"""
+
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from graph import Graph, Node, OUTGOING, INCOMING, BOTH
+from idset import IdSet, ID_SIZE, id_array
+from traverse import TraverserGenerator, BFS, k_hop, shortest_path
+
+
+# Default bound on the estimated size of the cached results
+MAX_BYTES = 64 << 20
+
+# Estimated bytes per cache entry and per node or prefix it read
+ENTRY_SIZE = 256
+TOUCH_SIZE = 120
+
+
+
+def adjacency_touches(node_id, rel, direction):
+    """The keys TrackingGraph records for a read of the edges of node_id"""
+    touches = []
+    if direction is not INCOMING:
+        touches.append(('l', node_id, rel))
+    if direction is not OUTGOING:
+        touches.append(('r', node_id, rel))
+    return touches
+    
+    
+def edge_touches(left_id, rel, right_id):
+    """The keys of the reads that a write to an edge may change"""
+    return [('l', left_id, rel), ('l', left_id, None),
+        ('r', right_id, rel), ('r', right_id, None)]
+
+
+
+class TrackingGraph(Graph):
+    """Read-only view of a graph that records what is read through it.
+    touched holds ('n', node_id) for node reads and ('l'|'r', node_id, rel)
+    for reads of outgoing or incoming edges. cacheable is False once
+    something untracked has been read."""
+    
+    def __init__(self, graph):
+        self.graph = graph
+        self.storage = graph.storage
+        self.last_node_id = graph.last_node_id
+        self.next_node_id = graph.next_node_id
+        self.adjacency = graph.adjacency
+        self.blob_threshold = graph.blob_threshold
+        self._tombstones = graph.deleted_ids()
+        self._write_lock = graph._write_lock
+        self._local = threading.local()
+        self._reset_change_buffers()
+        self._in_context = False
+        self._listeners = []
+        self.touched = set()
+        self.cacheable = True
+        
+        
+    def __getitem__(self, node_id):
+        self.touched.add(('n', node_id))
+        return Graph.__getitem__(self, node_id)
+        
+        
+    def __contains__(self, node_id):
+        self.touched.add(('n', node_id))
+        return Graph.__contains__(self, node_id)
+        
+        
+    def adjacent_edges(self, node_id, rel=None, direction=OUTGOING, limit=-1):
+        self.touched.update(adjacency_touches(node_id, rel, direction))
+        return Graph.adjacent_edges(self, node_id, rel, direction, limit)
+        
+        
+    def degree(self, node_id, rel=None, direction=OUTGOING, limit=-1):
+        self.touched.update(adjacency_touches(node_id, rel, direction))
+        return Graph.degree(self, node_id, rel, direction, limit)
+        
+        
+    def has_edge(self, left_id, rel, right_id):
+        self.touched.add(('l', left_id, rel))
+        return Graph.has_edge(self, left_id, rel, right_id)
+        
+        
+    def get_edge(self, left_id, rel, right_id):
+        self.touched.add(('l', left_id, rel))
+        return Graph.get_edge(self, left_id, rel, right_id)
+        
+        
+    def node_ids(self, start=1, stop=None, limit=-1):
+        self.cacheable = False
+        return Graph.node_ids(self, start, stop, limit)
+        
+        
+    def get_index(self, name):
+        self.cacheable = False
+        return Graph.get_index(self, name)
+        
+        
+    def to_igraph(self, *args, **kwargs):
+        self.cacheable = False
+        return Graph.to_igraph(self, *args, **kwargs)
+        
+        
+    def dirty(self, item):
+        raise RuntimeError, "Can't modify a graph while computing a cached result"
+        
+        
+    def save(self):
+        raise RuntimeError, "Can't modify a graph while computing a cached result"
+
+
+
+class TraversalCache(object):
+    """Results of reads of graph, least recently used first dropped once
+    their estimated size passes max_bytes or their number max_entries."""
+    
+    def __init__(self, graph, max_bytes=MAX_BYTES, max_entries=None):
+        self.graph = graph
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._readers = {}
+        self._commits = 0
+        self._lock = threading.RLock()
+        graph.add_listener(self._on_commit, self._on_begin)
+        
+        
+    def close(self):
+        """Stop listening to the graph and drop every result"""
+        self.graph.remove_listener(self._on_commit)
+        self.clear()
+        
+        
+    def __len__(self):
+        return len(self._entries)
+        
+        
+    def stats(self):
+        return dict(
+            entries = len(self._entries),
+            bytes = self.bytes,
+            hits = self.hits,
+            misses = self.misses,
+            evictions = self.evictions,
+            invalidations = self.invalidations
+        )
+        
+        
+    def call(self, key, f):
+        """Get the result of f(graph) cached under key. f is passed a
+        TrackingGraph and must only read through it."""
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # Mark as most recently used
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            commits = self._commits
+        finally:
+            self._lock.release()
+        view = TrackingGraph(self.graph)
+        result = f(view)
+        if view.cacheable:
+            self._add(key, result, view.touched, commits)
+        return result
+        
+        
+    def traverse(self, start_id, algorithm=BFS, rel=None, direction=OUTGOING,
+            max_depth=None, max_fanout=None, evaluator=None, name=None):
+        """Get the ids a Traverser from start_id returns, as a list. Without an
+        evaluator every node reached is returned. Evaluators can't be compared,
+        so one must come with a name that identifies it in the cache key."""
+        if evaluator is not None and name is None:
+            raise ValueError, "An evaluator must have a name"
+        rels = rel if rel is None or isinstance(rel, (int, long)) else tuple(rel)
+        key = ('traverse', start_id, algorithm, rels, direction, max_depth,
+            max_fanout, name)
+        def f(g):
+            return id_array(TraverserGenerator(
+                evaluator or _return_all, Node(g, start_id), algorithm, rel,
+                direction, max_depth, max_fanout).iter_ids())
+        return list(self.call(key, f))
+        
+        
+    def k_hop(self, node_id, k, rel=None, direction=OUTGOING):
+        """traverse.k_hop from node_id. Returns an IdSet."""
+        return self.call(('k_hop', node_id, k, rel, direction),
+            lambda g: k_hop(Node(g, node_id), k, rel, direction))
+            
+            
+    def shortest_path(self, a_id, b_id, rel=None, max_depth=None):
+        """traverse.shortest_path from a_id to b_id"""
+        path = self.call(('shortest_path', a_id, b_id, rel, max_depth),
+            lambda g: _tuple_or_none(shortest_path(Node(g, a_id), Node(g, b_id),
+                rel, max_depth)))
+        return None if path is None else list(path)
+        
+        
+    def invalidate(self, touches):
+        """Drop the results that read any of touches"""
+        self._lock.acquire()
+        try:
+            self._commits += 1
+            for t in touches:
+                for key in list(self._readers.get(t, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+        finally:
+            self._lock.release()
+            
+            
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._commits += 1
+            self._entries.clear()
+            self._readers.clear()
+            self.bytes = 0
+        finally:
+            self._lock.release()
+            
+            
+    def _on_begin(self):
+        self._lock.acquire()
+        try:
+            self._commits += 1
+        finally:
+            self._lock.release()
+            
+            
+    def _on_commit(self, changes):
+        if changes is None:
+            self.clear()
+            return
+        touches = set([('n', node_id) for node_id in changes.node_ids])
+        for e in changes.edges:
+            touches.update(edge_touches(*e))
+        # The edges of deleted nodes are hidden from then on without being
+        # written, so the reads of their prefixes change too
+        for node_id in changes.deleted_ids:
+            for e in self.graph.adjacent_edges_unfiltered(node_id, None, BOTH):
+                touches.update(edge_touches(*e))
+        self.invalidate(touches)
+        
+        
+    def _add(self, key, result, touched, commits):
+        size = ENTRY_SIZE + _sizeof(result) + TOUCH_SIZE * len(touched)
+        if size > self.max_bytes:
+            return
+        self._lock.acquire()
+        try:
+            # A commit that started or ended while computing may have
+            # changed what was read
+            if commits != self._commits or key in self._entries:
+                return
+            self._entries[key] = (result, touched, size)
+            for t in touched:
+                self._readers.setdefault(t, set()).add(key)
+            self.bytes += size
+            while self.bytes > self.max_bytes or (self.max_entries is not None
+                    and len(self._entries) > self.max_entries):
+                self._remove(iter(self._entries).next())
+                self.evictions += 1
+        finally:
+            self._lock.release()
+            
+            
+    def _remove(self, key):
+        result, touched, size = self._entries.pop(key)
+        for t in touched:
+            readers = self._readers[t]
+            readers.discard(key)
+            if not readers:
+                del self._readers[t]
+        self.bytes -= size
+        
+        
+        
+def _return_all(t):
+    return True
+    
+    
+def _tuple_or_none(path):
+    return None if path is None else tuple(path)
+    
+    
+def _sizeof(result):
+    """Estimate the bytes held by a result"""
+    if isinstance(result, array):
+        return sys.getsizeof(result) + len(result) * result.itemsize
+    if isinstance(result, IdSet):
+        return len(result) * ID_SIZE + 64
+    size = sys.getsizeof(result)
+    if isinstance(result, (list, tuple, set, frozenset)):
+        size += sum([sys.getsizeof(x) for x in result])
+    elif isinstance(result, dict):
+        size += sum([sys.getsizeof(k) + sys.getsizeof(v) for k, v in result.items()])
+    return size
\ No newline at end of file
@@ -0,0 +1,452 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Client for server.GraphServer
+
+RemoteGraph is a Graph whose storage lives in a GraphServer, so several
+processes can share one graph and one writer:
+
+    g = RemoteGraph('unix:/tmp/groof.sock')
+    with g:
+        n = g.create_node(name='x')
+    print g.k_hop(n.id, 2).count()
+
+Requests go over a pool of connections. A thread that starts a transaction
+keeps one connection until it commits or aborts. Node ids are reserved from
+the server in blocks, so ids are unique across clients but may have gaps.
+Snapshots of a RemoteGraph only order the writes made through it.
+"""
+
+import socket
+import threading
+from Queue import Queue, Empty
+from server import (
+    GET, SET, DELETE, CONTAINS, LENGTH, GETDUP, SETDUP, DELDUP, PREFIX, RANGE,
+    RECORDS, BEGIN, COMMIT, ABORT, INDEX_NAMES, ALLOCATE, NEIGHBORS, K_HOP,
+    SHORTEST_PATH, FLUSH, OK, KEY_ERROR, BAD_REQUEST, ProtocolError,
+    pack_frame, read_frame, pack_int, unpack_int, pack_optional_int,
+    unpack_ids, parse_address
+)
+from storage.abstract import IStorageGroup
+from keys import OUTGOING, pack_node_key
+from graph import Graph, Node
+from blobs import decode_attrs
+from idset import loads as loads_idset
+
+
+# Keys read per request when iterating a store
+ITER_PAGE_SIZE = 1000
+
+# Node ids reserved per request to the server
+ID_BLOCK_SIZE = 64
+
+# Pipelined requests are sent in windows of about this many bytes, and the
+# responses to a window are read before the next is sent. Otherwise the
+# server could block writing responses while the client is still sending.
+PIPELINE_WINDOW = 32 << 10
+
+# Nodes loaded per pipeline by get_nodes
+GET_NODES_BATCH_SIZE = 1000
+
+
+
+class RemoteError(Exception):
+    """An error raised by the server"""
+
+
+
+class Connection(object):
+
+    def __init__(self, address, timeout=None):
+        family, addr = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(addr)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+        self.next_request_id = 0
+        
+        
+    def call(self, op, *args):
+        result = self.pipeline([(op, args)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+        
+        
+    def pipeline(self, requests):
+        """Send (op, args) requests without waiting for responses, then read
+        the responses. Returns a list of results; failed requests give the
+        exception instead."""
+        results = []
+        ids = []
+        frames = []
+        size = 0
+        for op, args in requests:
+            self.next_request_id = (self.next_request_id + 1) & 0xFFFFFFFF
+            ids.append(self.next_request_id)
+            frames.append(pack_frame(self.next_request_id, op, args))
+            size += len(frames[-1])
+            if size >= PIPELINE_WINDOW:
+                self._exchange(frames, ids, results)
+                ids = []
+                frames = []
+                size = 0
+        if frames:
+            self._exchange(frames, ids, results)
+        return results
+        
+        
+    def _exchange(self, frames, ids, results):
+        """Send frames and append the responses to results"""
+        self.sock.sendall(''.join(frames))
+        for request_id in ids:
+            frame = read_frame(self.rfile)
+            if frame is None:
+                raise ProtocolError, "Connection closed by server"
+            response_id, status, values = frame
+            if response_id != request_id:
+                raise ProtocolError, "Expected response %d, got %d" % (
+                    request_id, response_id)
+            if status == OK:
+                results.append(values)
+            elif status == KEY_ERROR:
+                results.append(KeyError(values[0]))
+            elif status == BAD_REQUEST:
+                results.append(ProtocolError(values[0]))
+            else:
+                results.append(RemoteError(values[0]))
+        
+        
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+
+class ConnectionPool(object):
+    """At most size connections to address, shared between threads"""
+    
+    def __init__(self, address, size=8, timeout=None):
+        self.address = address
+        self.size = size
+        self.timeout = timeout
+        self._idle = Queue()
+        self._count = 0
+        self._lock = threading.Lock()
+        
+        
+    def get(self):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+        self._lock.acquire()
+        try:
+            create = self._count < self.size
+            if create:
+                self._count += 1
+        finally:
+            self._lock.release()
+        if not create:
+            return self._idle.get()
+        try:
+            return Connection(self.address, self.timeout)
+        except:
+            self._discarded()
+            raise
+            
+            
+    def put(self, conn):
+        self._idle.put(conn)
+        
+        
+    def discard(self, conn):
+        """Close a connection that can no longer be used"""
+        try:
+            conn.close()
+        finally:
+            self._discarded()
+            
+            
+    def _discarded(self):
+        self._lock.acquire()
+        try:
+            self._count -= 1
+        finally:
+            self._lock.release()
+            
+            
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            self.discard(conn)
+
+
+
+class RemoteStorage(object):
+    """A store of a RemoteStorageGroup"""
+    
+    def __init__(self, group, name):
+        self._group = group
+        self.name = name
+        
+        
+    def __getitem__(self, k):
+        return self._group.call(GET, self.name, k)[0]
+        
+        
+    def __setitem__(self, k, v):
+        self._group.call(SET, self.name, k, v)
+        
+        
+    def __delitem__(self, k):
+        self._group.call(DELETE, self.name, k)
+        
+        
+    def __contains__(self, k):
+        return self._group.call(CONTAINS, self.name, k)[0] != ''
+        
+        
+    def __len__(self):
+        return unpack_int(self._group.call(LENGTH, self.name)[0])
+        
+        
+    def getdup(self, k):
+        return self._group.call(GETDUP, self.name, k)
+        
+        
+    def setdup(self, k, v):
+        self._group.call(SETDUP, self.name, k, v)
+        
+        
+    def deldup(self, k):
+        self._group.call(DELDUP, self.name, k)
+        
+        
+    def match_prefix(self, prefix, limit=-1):
+        return self._group.call(PREFIX, self.name, prefix, pack_int(limit))
+        
+        
+    def range(self, start, stop=None, limit=-1):
+        return self._group.call(RANGE, self.name, start, stop, pack_int(limit))
+        
+        
+    def __iter__(self):
+        start = ''
+        while True:
+            keys = self.range(start, None, ITER_PAGE_SIZE)
+            for k in keys:
+                yield k
+            if len(keys) < ITER_PAGE_SIZE:
+                return
+            start = keys[-1] + '\x00'
+            
+            
+    def iter_records(self):
+        start = ''
+        while True:
+            values = self._group.call(RECORDS, self.name, start, pack_int(ITER_PAGE_SIZE))
+            for i in xrange(0, len(values), 2):
+                yield values[i], values[i+1]
+            if not values:
+                return
+            start = values[-2] + '\x00'
+            
+            
+    def start_txn(self):
+        self._group.start_txn()
+        
+        
+    def abort_txn(self):
+        self._group.abort_txn()
+        
+        
+    def commit_txn(self):
+        self._group.commit_txn()
+
+
+
+class RemoteStorageGroup(IStorageGroup):
+    """Storage group served by a GraphServer at address"""
+    
+    def __init__(self, address, pool_size=8, timeout=None):
+        self.pool = ConnectionPool(address, pool_size, timeout)
+        for n in self.storage_attrs:
+            setattr(self, n, RemoteStorage(self, n))
+        self.indices = {}
+        self._local = threading.local()
+        
+        
+    def call(self, op, *args):
+        return self.pipeline([(op, args)], True)[0]
+        
+        
+    def pipeline(self, requests, raise_errors=False):
+        """Send many (op, args) requests in one round trip. See
+        Connection.pipeline."""
+        conn = getattr(self._local, 'conn', None)
+        pinned = conn is not None
+        if not pinned:
+            conn = self.pool.get()
+        try:
+            results = conn.pipeline(requests)
+        except (socket.error, ProtocolError):
+            self.pool.discard(conn)
+            if pinned:
+                self._local.conn = None
+            raise
+        if not pinned:
+            self.pool.put(conn)
+        if raise_errors:
+            for r in results:
+                if isinstance(r, Exception):
+                    raise r
+        return results
+        
+        
+    def get_index(self, name):
+        if name not in self.indices:
+            self.indices[name] = RemoteStorage(self, 'index:' + name)
+        return self.indices[name]
+        
+        
+    def index_names(self):
+        return self.call(INDEX_NAMES)
+        
+        
+    def allocate(self, n):
+        """Reserve n node ids and return the first"""
+        return unpack_int(self.call(ALLOCATE, pack_int(n))[0])
+        
+        
+    def start_txn(self):
+        if getattr(self._local, 'conn', None) is not None:
+            raise RuntimeError, "Transaction already started"
+        self._local.conn = self.pool.get()
+        try:
+            self.call(BEGIN)
+        except:
+            self._release()
+            raise
+            
+            
+    def abort_txn(self):
+        try:
+            self.call(ABORT)
+        finally:
+            self._release()
+            
+            
+    def commit_txn(self):
+        try:
+            self.call(COMMIT)
+        finally:
+            self._release()
+            
+            
+    def _release(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            self.pool.put(conn)
+            
+            
+    def flush(self):
+        self.call(FLUSH)
+        
+        
+    def open(self):
+        pass
+        
+        
+    def close(self):
+        self.pool.close()
+
+
+
+class RemoteGraph(Graph):
+    """A graph served by a GraphServer at address"""
+    
+    def __init__(self, address, pool_size=8, timeout=None):
+        Graph.__init__(self, RemoteStorageGroup(address, pool_size, timeout))
+        self.id_block_size = ID_BLOCK_SIZE
+        self._ids = iter(())
+        self._ids_lock = threading.Lock()
+        
+        
+    def create_node(self, **kwargs):
+        n = Node(self, self._allocate_id(), kwargs)
+        self.dirty(n)
+        return n
+        
+        
+    def _allocate_id(self):
+        self._ids_lock.acquire()
+        try:
+            for node_id in self._ids:
+                return node_id
+            first = self.storage.group.allocate(self.id_block_size)
+            self._ids = iter(xrange(first + 1, first + self.id_block_size))
+            return first
+        finally:
+            self._ids_lock.release()
+            
+            
+    def get_nodes(self, node_ids):
+        """Load many nodes in a round trip per GET_NODES_BATCH_SIZE ids. Missing
+        nodes are skipped."""
+        node_ids = list(node_ids)
+        nodes = []
+        for i in xrange(0, len(node_ids), GET_NODES_BATCH_SIZE):
+            batch = node_ids[i:i+GET_NODES_BATCH_SIZE]
+            results = self.storage.group.pipeline(
+                [(GET, ('node', pack_node_key(n))) for n in batch])
+            for node_id, r in zip(batch, results):
+                if isinstance(r, KeyError):
+                    continue
+                elif isinstance(r, Exception):
+                    raise r
+                attrs, blob_names = decode_attrs(self.storage, node_id, r[0])
+                nodes.append(Node(self, node_id, attrs, blob_names))
+        return nodes
+        
+        
+    def neighbor_ids(self, node_id, rel=None, direction=OUTGOING, limit=-1):
+        return unpack_ids(self.storage.group.call(NEIGHBORS, pack_int(node_id),
+            pack_optional_int(rel), pack_int(direction), pack_int(limit))[0])
+            
+            
+    def k_hop(self, node_id, k, rel=None, direction=OUTGOING):
+        """traverse.k_hop run by the server. Returns an IdSet."""
+        return loads_idset(self.storage.group.call(K_HOP, pack_int(node_id),
+            pack_int(k), pack_optional_int(rel), pack_int(direction))[0])
+            
+            
+    def shortest_path(self, a_id, b_id, rel=None, max_depth=None):
+        """traverse.shortest_path run by the server"""
+        path = self.storage.group.call(SHORTEST_PATH, pack_int(a_id),
+            pack_int(b_id), pack_optional_int(rel), pack_optional_int(max_depth))
+        return unpack_ids(path[0]) if path else None
\ No newline at end of file
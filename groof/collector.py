@@ -0,0 +1,152 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Background reclamation of the edges of deleted nodes
+
+Graph.save deletes a node by removing its record and writing a tombstone, so
+deleting a node with millions of edges costs the same as deleting a leaf.
+Readers stop seeing the edges of tombstoned nodes immediately. An
+EdgeCollector then removes those edges in small transactions, so writers
+are never held up for long, and drops each tombstone once the node has no
+edges left.
+
+    collector = EdgeCollector(g)
+    collector.start()   # collect in a background thread
+    ...
+    print collector.stats()
+    collector.stop()
+"""
+
+import threading
+import time
+from keys import (
+    OUTGOING, INCOMING, pack_node_key, unpack_node_key, pack_edge_key,
+    unpack_edge_key
+)
+from graph import Changes
+
+
+
+class EdgeCollector(object):
+
+    def __init__(self, graph, batch_size=1000, interval=1.0):
+        self.graph = graph
+        self.batch_size = batch_size
+        self.interval = interval
+        self.batches = 0
+        self.edges_reclaimed = 0
+        self.nodes_reclaimed = 0
+        self.busy_time = 0.0
+        self.last_batch_time = None
+        self._stopping = threading.Event()
+        self._thread = None
+        
+        
+    def stats(self):
+        return dict(
+            pending_nodes = len(self.graph.storage.tombstones),
+            batches = self.batches,
+            edges_reclaimed = self.edges_reclaimed,
+            nodes_reclaimed = self.nodes_reclaimed,
+            busy_time = self.busy_time,
+            last_batch_time = self.last_batch_time
+        )
+        
+        
+    def collect_batch(self):
+        """Remove up to batch_size edges of one deleted node in a transaction.
+        Returns False when there is nothing left to collect."""
+        storage = self.graph.storage
+        node_keys = storage.tombstones.range(pack_node_key(0), None, 1)
+        if not node_keys:
+            return False
+        node_id = unpack_node_key(node_keys[0])
+        started = time.time()
+        self.graph._write_lock.acquire()
+        try:
+            storage.start_txn()
+            try:
+                self.graph.notify_begin()
+                edges = [unpack_edge_key(k) for k in storage.left.match_prefix(
+                    node_keys[0], self.batch_size)]
+                if len(edges) < self.batch_size:
+                    # self loops were already read from the left store
+                    edges.extend([e for e in self.graph.adjacency.edges(
+                        node_id, None, INCOMING, self.batch_size - len(edges))
+                        if e[0] != node_id])
+                for edge in edges:
+                    del storage.left[pack_edge_key(*edge)]
+                self.graph.adjacency.apply([], edges)
+                done = len(edges) < self.batch_size and not \
+                    self.graph.adjacency.edges(node_id, None, OUTGOING, 1) and not \
+                    self.graph.adjacency.edges(node_id, None, INCOMING, 1)
+                if done:
+                    del storage.tombstones[node_keys[0]]
+                storage.commit_txn()
+            except:
+                storage.abort_txn()
+                self.graph.notify_abort()
+                raise
+            if done:
+                self.graph.load_tombstones()
+            self.graph.notify(Changes(set([node_id]), set(), edges))
+        finally:
+            self.graph._write_lock.release()
+        if done:
+            self.nodes_reclaimed += 1
+        self.batches += 1
+        self.edges_reclaimed += len(edges)
+        self.last_batch_time = time.time() - started
+        self.busy_time += self.last_batch_time
+        return True
+        
+        
+    def run(self, max_batches=None):
+        """Collect in the calling thread until nothing is left or max_batches
+        batches have run"""
+        n = 0
+        while max_batches is None or n < max_batches:
+            if not self.collect_batch():
+                break
+            n += 1
+        return n
+        
+        
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError, "Collector already started"
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        
+        
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        
+        
+    def _loop(self):
+        while not self._stopping.isSet():
+            if not self.collect_batch():
+                self._stopping.wait(self.interval)
\ No newline at end of file
@@ -19,62 +19,60 @@
 # THE SOFTWARE.
 
 
-import struct
 import cjson
 import threading
+from keys import (
+    OUTGOING, INCOMING, BOTH, KEY_FORMAT_VERSION, NODE_KEY_FORMAT,
+    NODE_KEY_SIZE, REL_FORMAT, REL_SIZE, EDGE_KEY_FORMAT, EDGE_KEY_SIZE,
+    EDGE_KEY_PREFIX_FORMAT, META_FORMAT, META_KEY, LEGACY_META_KEY,
+    pack_node_key, unpack_node_key, pack_edge_key, unpack_edge_key,
+    invert_edge_key, pack_edge_key_prefix, pack_meta, unpack_meta
+)
+from adjacency import Adjacency
+from mvcc import VersionedStorageGroup
+from idset import IdSet
+import backup
+from blobs import BlobRef, BLOB_THRESHOLD, decode_attrs, encode_attrs, delete_blobs
 
 try:
     import igraph
     igraph_available = True
 except ImportError:
     igraph_available = False
+    
+try:
+    import numpy
+    numpy_available = True
+except ImportError:
+    numpy_available = False
 
 
-OUTGOING = 0
-INCOMING = 1
-
-
-NODE_KEY_FORMAT = 'Q'
-NODE_KEY_SIZE = struct.calcsize(NODE_KEY_FORMAT)
-REL_FORMAT = 'I'
-REL_SIZE = struct.calcsize(REL_FORMAT)
-EDGE_KEY_FORMAT = 'QIQ'
-EDGE_KEY_SIZE = struct.calcsize(EDGE_KEY_FORMAT)
-
-
-def pack_node_key(id):
-    return struct.pack(NODE_KEY_FORMAT, id)
-    
-    
-def unpack_node_key(s):
-    return struct.unpack(NODE_KEY_FORMAT, s)[0]
-    
-    
-def pack_edge_key(left_id, rel, right_id):
-    return struct.pack(EDGE_KEY_FORMAT, left_id, rel, right_id)
-    
-    
-def unpack_edge_key(s):
-    return struct.unpack(EDGE_KEY_FORMAT, s)
+# Record layout of edge rows returned as an array
+EDGE_ROW_DTYPE = [('left_id', 'u8'), ('rel', 'u4'), ('right_id', 'u8')]
 
 
-def invert_edge_key(edge_key_string):
-    return edge_key_string[REL_SIZE+NODE_KEY_SIZE:]+\
-        edge_key_string[NODE_KEY_SIZE:NODE_KEY_SIZE+REL_SIZE]+\
-        edge_key_string[:NODE_KEY_SIZE]
-        
-        
-def pack_edge_key_prefix(node_id, rel):
-    if rel is None:
-        return pack_node_key(node_id)
-    return struct.pack(EDGE_KEY_FORMAT[:2], node_id, rel)
+def edge_rows(keys, rows='tuples'):
+    """Get (left_id, rel, right_id) edge keys as a list of tuples or, if rows
+    is 'array', as a numpy structured array with EDGE_ROW_DTYPE"""
+    if rows == 'tuples':
+        return list(keys)
+    elif rows == 'array':
+        if not numpy_available:
+            raise RuntimeError, "numpy is not available"
+        return numpy.array(list(keys), dtype=EDGE_ROW_DTYPE)
+    raise ValueError, "Unknown row format: %s" % rows
 
 
 
 class AttrsMixin(object):
+
+    __slots__ = ()
     
     def __getitem__(self, k):
-        return self._attrs[k]
+        v = self._attrs[k]
+        if v.__class__ is BlobRef:
+            return v.load()
+        return v
         
         
     def __setitem__(self, k, v):
@@ -95,11 +93,11 @@ class AttrsMixin(object):
         
         
     def items(self):
-        return self._attrs.items()
+        return [(k, self[k]) for k in self._attrs]
         
         
     def values(self):
-        return self._attrs.values()
+        return [self[k] for k in self._attrs]
         
         
     def __iter__(self):
@@ -108,14 +106,33 @@ class AttrsMixin(object):
 
 
 class Edge(AttrsMixin):
+    """An edge. If attrs is None they are read from storage when first
+    accessed."""
     
+    __slots__ = ('_graph', 'left_id', 'rel', 'right_id', '_loaded_attrs')
     
     def __init__(self, graph, left_id, rel, right_id, attrs=None):
         self._graph = graph
         self.left_id = left_id
         self.rel = rel
         self.right_id = right_id
-        self._attrs = attrs if attrs is not None else {}
+        self._loaded_attrs = attrs
+        
+        
+    def _get_attrs(self):
+        if self._loaded_attrs is None:
+            try:
+                self._loaded_attrs = cjson.decode(self._graph.storage.left[
+                    pack_edge_key(self.left_id, self.rel, self.right_id)])
+            except KeyError:
+                self._loaded_attrs = {}
+        return self._loaded_attrs
+    _attrs = property(_get_attrs)
+    
+    
+    def _get_key(self):
+        return (self.left_id, self.rel, self.right_id)
+    key = property(_get_key)
         
         
     def _get_left(self):
@@ -129,22 +146,27 @@ class Edge(AttrsMixin):
     
     
     def remove(self):
-        self._graph.remove_edge(self)
+        self._graph.delete_edge(self)
+
 
 
+class Edges(object):
 
-class Edges():
+    __slots__ = ('_graph', '_node')
     
     def __init__(self, graph, node):
         self._graph = graph
         self._node = node
         
         
-    def __call__(self, rel=None, other=None, direction=OUTGOING):
+    def __call__(self, rel=None, other=None, direction=OUTGOING, rows=None):
         if direction is OUTGOING:
-            return self._graph.get_edges(rel, left=self._node, right=other)
+            return self._graph.get_edges(rel, left=self._node, right=other, rows=rows)
         elif direction is INCOMING:
-            return self._graph.get_edges(rel, left=other, right=self._node)
+            return self._graph.get_edges(rel, left=other, right=self._node, rows=rows)
+        elif rows is not None:
+            return edge_rows(self(rel, other, OUTGOING, 'tuples') +
+                self(rel, other, INCOMING, 'tuples'), rows)
         else:
             return self._graph.get_edges(
                 rel, left=self._node, right=other)+self._graph.get_edges(
@@ -160,6 +182,11 @@ class Edges():
             return self._graph.count_edges(
                 rel, left=self._node, right=other)+self._graph.count_edges(
                 rel, left=other, right=self._node)
+                
+                
+    def idset(self, rel=None, direction=OUTGOING):
+        """Get the ids of adjacent nodes as an IdSet"""
+        return IdSet(self._graph.neighbor_ids(self._node.id, rel, direction))
         
         
     def add(self, rel, right, **kwargs):
@@ -169,15 +196,15 @@ class Edges():
 
 class Node(AttrsMixin):
     
-    __slots__ = ('_id', '_attrs', 'edges')
+    __slots__ = ('_graph', '_id', '_attrs', '_blob_names')
     
-    def __init__(self, graph, id, attrs=None):
+    def __init__(self, graph, id, attrs=None, blob_names=()):
         object.__setattr__(self, '_graph', graph)
         object.__setattr__(self, '_id', id)
         if attrs is None:
             attrs = {}
         object.__setattr__(self, '_attrs', attrs)
-        object.__setattr__(self, 'edges', Edges(self._graph, self))
+        object.__setattr__(self, '_blob_names', blob_names)
         
         
     def _get_id(self):
@@ -185,6 +212,11 @@ class Node(AttrsMixin):
     id = property(_get_id)
     
     
+    def _get_edges(self):
+        return Edges(self._graph, self)
+    edges = property(_get_edges)
+    
+    
     def delete(self):
         del self._graph[self.id]
 
@@ -235,6 +267,27 @@ class Index(object):
         return nodes
         
         
+    def ids(self, k):
+        """Get the ids of all nodes stored at key k without loading them"""
+        try:
+            return [unpack_node_key(v) for v in self._index.getdup(k)]
+        except KeyError:
+            return []
+            
+            
+    def count(self, k):
+        """Get the number of node ids stored at key k"""
+        try:
+            return len(self._index.getdup(k))
+        except KeyError:
+            return 0
+            
+            
+    def idset(self, k):
+        """Get the ids of all nodes stored at key k as an IdSet"""
+        return IdSet(self.ids(k))
+        
+        
     def setmulti(self, k, node):
         self._index.setdup(k, pack_node_key(node.id))
         
@@ -249,35 +302,91 @@ class Index(object):
 
 
 
+class Changes(object):
+    """What one commit changed, as passed to commit listeners. node_ids holds
+    the ids of written and deleted nodes, deleted_ids the deleted ones and
+    edges the (left_id, rel, right_id) keys of written and deleted edges."""
+    
+    def __init__(self, node_ids, deleted_ids, edges):
+        self.node_ids = node_ids
+        self.deleted_ids = deleted_ids
+        self.edges = edges
+
+
+
 class Graph(object):
     
     def __init__(self, storage):
+        if not isinstance(storage, VersionedStorageGroup):
+            storage = VersionedStorageGroup(storage)
         self.storage = storage
         try:
-            self.last_node_id = self.next_node_id = struct.unpack(
-                'Q', self.storage.node[struct.pack('i', 0)])[0]
+            version, next_node_id = unpack_meta(self.storage.node[META_KEY])
         except KeyError:
-            self.last_node_id = self.next_node_id = 0
-            self.storage.node[struct.pack('i', 0)] = struct.pack('Q', 0)
+            if LEGACY_META_KEY in self.storage.node:
+                version = 0
+            else:
+                version, next_node_id = KEY_FORMAT_VERSION, 0
+                self.storage.node[META_KEY] = pack_meta(0)
+        if version != KEY_FORMAT_VERSION:
+            raise RuntimeError, "Storage uses key format %d, expected %d; "\
+                "convert it with groof.migrate" % (version, KEY_FORMAT_VERSION)
+        self.last_node_id = self.next_node_id = next_node_id
+        self.adjacency = Adjacency(self.storage)
+        self.blob_threshold = BLOB_THRESHOLD
+        self.load_tombstones()
+        self._write_lock = threading.RLock()
         self._local = threading.local()
         self._reset_change_buffers()
         self._in_context = False
+        self._listeners = []
+        
+        
+    def close(self):
+        """Close the storage files of the graph"""
+        self.storage.close()
+        
+        
+    def snapshot(self):
+        """Get a read-only view of the graph as of the last commit. Readers of
+        the snapshot never wait on or see writes made after it was taken.
+        Release it when done so old record versions can be dropped."""
+        self._write_lock.acquire()
+        try:
+            return Snapshot(self)
+        finally:
+            self._write_lock.release()
+            
+            
+    def dump(self, path, incremental=False):
+        """Write the graph to a dump file. An incremental dump holds only the
+        changes since the previous dump. See groof.backup."""
+        return backup.dump(self, path, incremental)
+        
+        
+    def restore(self, path):
+        """Load a dump file written by dump"""
+        return backup.restore(self, path)
         
         
     def __getitem__(self, node_id):
         k = pack_node_key(node_id)
         try:
-            attrs = cjson.decode(self.storage.node[k])
+            s = self.storage.node[k]
         except KeyError:
             raise KeyError, "No node found with id %s" % node_id
-        return Node(self, node_id, attrs)
+        attrs, blob_names = decode_attrs(self.storage, node_id, s)
+        return Node(self, node_id, attrs, blob_names)
             
             
     def __delitem__(self, node_id):
-        k = pack_node_key(node_id)
-        self._local.removed_nodes.add(k)
-            
-            
+        self._local.removed_nodes.add(node_id)
+        
+        
+    def __contains__(self, node_id):
+        return node_id > 0 and pack_node_key(node_id) in self.storage.node
+        
+        
     def __len__(self):
         return len(self.storage.node)-1
         
@@ -286,6 +395,14 @@ class Graph(object):
         return Index(name, self)
         
         
+    def node_ids(self, start=1, stop=None, limit=-1):
+        """Get the ids of existing nodes with start <= id < stop in id order,
+        at most limit ids if limit is not negative"""
+        stop_key = None if stop is None else pack_node_key(stop)
+        return [unpack_node_key(k) for k in self.storage.node.range(
+            pack_node_key(max(start, 1)), stop_key, limit)]
+        
+        
     def stats(self):
         return dict(
             num_nodes = len(self),
@@ -304,87 +421,225 @@ class Graph(object):
         k = pack_edge_key(left.id, rel, right.id)
         if k in self.storage.left:
             raise RuntimeError, "This edge already exists"
-        e = Edge(self, left.id, rel, right.id, attrs)
+        e = Edge(self, left.id, rel, right.id, attrs if attrs is not None else {})
         self.dirty(e)
         return e
         
         
-    def get_edges(self, rel, left=None, right=None):
+    def get_edges(self, rel, left=None, right=None, rows=None):
+        """Get the edges of type rel from left and/or to right. Edge attributes
+        are read when first accessed. If rows is 'tuples' or 'array' the edges
+        are returned as rows instead of Edge objects, see edge_rows."""
         if left is None and right is None:
             raise ValueError, "Must specify at least one of left,right"
-        edges = []
         if left is None:
-            prefix = pack_edge_key_prefix(right.id, rel)
-            for k in self.storage.right.match_prefix(prefix):
-                k = invert_edge_key(k)
-                (left_id, rel, right_id) = unpack_edge_key(k)
-                attrs = self.storage.left[k]
-                edges.append(Edge(self, left_id, rel, right_id, attrs))
+            keys = self.adjacent_edges(right.id, rel, INCOMING)
         elif right is None:
-            prefix = pack_edge_key_prefix(left.id, rel)
-            for k in self.storage.left.match_prefix(prefix):
-                (left_id, rel, right_id) = unpack_edge_key(k)
-                attrs = self.storage.left[k]
-                edges.append(Edge(self, left_id, rel, right_id, attrs))
+            keys = self.adjacent_edges(left.id, rel, OUTGOING)
+        elif self.has_edge(left.id, rel, right.id):
+            keys = [(left.id, rel, right.id)]
         else:
-            try:
-                attrs = self.storage.left[pack_edge_key(left.id, rel, right.id)]
-                edges.append(Edge(self, left.id, rel, right.id, attrs))
-            except KeyError:
-                pass
-        return edges
+            keys = []
+        if rows is not None:
+            return edge_rows(keys, rows)
+        return [Edge(self, left_id, rel, right_id)
+            for (left_id, rel, right_id) in keys]
         
         
     def count_edges(self, rel, left=None, right=None):
         if left is None and right is None:
             raise ValueError, "Must specify at least one of left,right"
-        edges = []
         if left is None:
-            prefix = pack_edge_key_prefix(right.id, rel)
-            return len(self.storage.right.match_prefix(prefix))
+            return self.degree(right.id, rel, INCOMING)
         elif right is None:
-            prefix = pack_edge_key_prefix(left.id, rel)
-            return len(self.storage.left.match_prefix(prefix))
+            return self.degree(left.id, rel, OUTGOING)
         else:
-            return 1 if pack_edge_key(right.id, rel, left.id) in self.storage.right else 0
+            return 1 if self.has_edge(left.id, rel, right.id) else 0
+            
+            
+    def get_edge(self, left_id, rel, right_id):
+        try:
+            if self.is_deleted(left_id) or self.is_deleted(right_id):
+                raise KeyError
+            attrs = cjson.decode(self.storage.left[pack_edge_key(left_id, rel, right_id)])
+        except KeyError:
+            raise KeyError, "No edge found for %s" % ((left_id, rel, right_id),)
+        return Edge(self, left_id, rel, right_id, attrs)
+        
+        
+    def adjacent_edges(self, node_id, rel=None, direction=OUTGOING, limit=-1):
+        """Get (left_id, rel, right_id) tuples for the edges of node_id without
+        creating Edge objects. Edges of deleted nodes are left out."""
+        dead = self.deleted_ids()
+        if not dead:
+            return self.adjacent_edges_unfiltered(node_id, rel, direction, limit)
+        if node_id in dead:
+            return []
+        # Read twice as many edges each time until limit live ones are found
+        n = limit
+        while True:
+            edges = self.adjacent_edges_unfiltered(node_id, rel, direction, n)
+            live = [e for e in edges if e[0] not in dead and e[2] not in dead]
+            if n < 0 or len(live) >= limit or len(edges) < n:
+                return live if limit < 0 else live[:limit]
+            n *= 2
+        
+        
+    def adjacent_edges_unfiltered(self, node_id, rel=None, direction=OUTGOING, limit=-1):
+        if direction is BOTH:
+            edges = self.adjacency.edges(node_id, rel, OUTGOING, limit)
+            if limit >= 0:
+                limit -= len(edges)
+                if limit == 0:
+                    return edges
+            return edges + self.adjacency.edges(node_id, rel, INCOMING, limit)
+        return self.adjacency.edges(node_id, rel, direction, limit)
+        
+        
+    def neighbor_ids(self, node_id, rel=None, direction=OUTGOING, limit=-1):
+        """Get the ids of nodes adjacent to node_id without creating Node or
+        Edge objects"""
+        return [l if r == node_id else r for (l, _, r) in
+            self.adjacent_edges(node_id, rel, direction, limit)]
+        
+        
+    def degree(self, node_id, rel=None, direction=OUTGOING, limit=-1):
+        """Count the edges of node_id in one direction. If limit is given,
+        stop counting once limit edges have been seen."""
+        if self.deleted_ids():
+            return len(self.adjacent_edges(node_id, rel, direction, limit))
+        if direction is BOTH:
+            n = self.adjacency.count(node_id, rel, OUTGOING, limit)
+            if limit >= 0:
+                limit -= n
+                if limit == 0:
+                    return n
+            return n + self.adjacency.count(node_id, rel, INCOMING, limit)
+        return self.adjacency.count(node_id, rel, direction, limit)
+        
+        
+    def has_edge(self, left_id, rel, right_id):
+        if self.is_deleted(left_id) or self.is_deleted(right_id):
+            return False
+        return pack_edge_key(left_id, rel, right_id) in self.storage.left
+        
+        
+    def deleted_ids(self):
+        """Get the ids of deleted nodes whose edges have not been collected yet.
+        Their edges are hidden from readers until the collector reclaims them.
+        The set is kept up to date by save, the collector and restore; call
+        load_tombstones to see nodes deleted through other handles."""
+        return self._tombstones
+        
+        
+    def load_tombstones(self):
+        self._tombstones = set([unpack_node_key(k) for k in self.storage.tombstones])
+        
+        
+    def is_deleted(self, node_id):
+        dead = self.deleted_ids()
+        return bool(dead) and node_id in dead
         
         
     def delete_edge(self, edge):
         self._local.removed_edges.add(pack_edge_key(edge.left_id, edge.rel, edge.right_id))
         
         
+    def add_listener(self, f, begin=None):
+        """Call f with a Changes after every commit made by save. Listeners run
+        with the write lock held, so they should be quick. Writes that bypass
+        save, such as index updates, are not reported. f is called with None
+        when the whole graph may have changed, e.g. after a restore. If given,
+        begin is called before a commit starts writing; f is then called once
+        it ends, with an empty Changes if it was aborted."""
+        self._listeners.append((f, begin))
+        
+        
+    def remove_listener(self, f):
+        for listener in self._listeners:
+            if listener[0] == f:
+                self._listeners.remove(listener)
+                return
+        raise ValueError, "Not a listener"
+        
+        
+    def notify_begin(self):
+        for f, begin in list(self._listeners):
+            if begin is not None:
+                begin()
+                
+                
+    def notify(self, changes):
+        for f, begin in list(self._listeners):
+            f(changes)
+            
+            
+    def notify_abort(self):
+        self.notify(Changes(set(), set(), []))
+            
+            
     def save(self):
+        self._write_lock.acquire()
+        try:
+            self._save()
+        finally:
+            self._write_lock.release()
+            
+            
+    def _save(self):
         self.storage.start_txn()
         try:
+            self.notify_begin()
+            removed_edges = []
             for k in self._local.removed_edges:
-                try:
+                if k in self.storage.left:
                     del self.storage.left[k]
-                    del self.storage.left[invert_edge_key(k)]
-                except KeyError:
-                    pass
-            for node_id in self._local.removed_edges:
+                    removed_edges.append(unpack_edge_key(k))
+            # Deleting a node only removes its record and writes a tombstone.
+            # Its edges are hidden from then on and reclaimed later in small
+            # batches by a collector.EdgeCollector.
+            for node_id in self._local.removed_nodes:
                 node_key = pack_node_key(node_id)
                 if node_key in self.storage.node:
-                    for k in self.storage.left.match_prefix(node_key):
-                        del self.storage.left[k]
-                    for k in self.storage.right.match_prefix(node_key):
-                        del self.storage.right[k]
                     del self.storage.node[node_key]
+                    self.storage.tombstones[node_key] = ''
+                    delete_blobs(self.storage, node_id)
             for n in self._local.dirty_nodes:
-                self.storage.node[pack_node_key(n.id)] = cjson.encode(n._attrs)
+                if n.id in self._local.removed_nodes:
+                    continue
+                s, n._blob_names = encode_attrs(self.storage, n.id, n._attrs,
+                    n._blob_names, self.blob_threshold)
+                self.storage.node[pack_node_key(n.id)] = s
+            added_edges = []
             for e in self._local.dirty_edges:
                 k = pack_edge_key(e.left_id, e.rel, e.right_id)
+                if k not in self.storage.left:
+                    added_edges.append((e.left_id, e.rel, e.right_id))
                 self.storage.left[k] = cjson.encode(e._attrs)
-                self.storage.right[invert_edge_key(k)] = ''
+            self.adjacency.apply(added_edges, removed_edges)
+            removed_nodes = self._local.removed_nodes
+            if self._listeners:
+                changes = Changes(
+                    set([n.id for n in self._local.dirty_nodes]) | removed_nodes,
+                    removed_nodes,
+                    removed_edges + [(e.left_id, e.rel, e.right_id)
+                        for e in self._local.dirty_edges])
+            else:
+                changes = None
             self._reset_change_buffers()
             num_new_nodes = self.next_node_id - self.last_node_id
             if num_new_nodes > 0:
-                self.storage.node[struct.pack('i', 0)] = struct.pack('Q', self.next_node_id)
+                self.storage.node[META_KEY] = pack_meta(self.next_node_id)
                 self.last_node_id = self.next_node_id
             self.storage.commit_txn()
         except:
             self.storage.abort_txn()
+            self.notify_abort()
             raise
+        if removed_nodes:
+            self.load_tombstones()
+        if changes is not None:
+            self.notify(changes)
         
         
     def revert(self):
@@ -433,18 +688,20 @@ class Graph(object):
             node_map[node_id] = i
             node_ids.append(node_id)
         
+        # Edges of deleted nodes stay in the left store until collected
+        dead = self.deleted_ids()
+        
         def gen_edges_for_rel():
-            for k in self.storage.right:
-                k = invert_edge_key(k)
+            for k in self.storage.left:
                 edge = unpack_edge_key(k)
-                if edge[1] == rel:
+                if edge[1] == rel and edge[0] not in dead and edge[2] not in dead:
                     yield k, (node_map[edge[0]],node_map[edge[2]])
         
         def gen_edges():
-            for k in self.storage.right:
-                k = invert_edge_key(k)
+            for k in self.storage.left:
                 edge = unpack_edge_key(k)
-                yield k, (node_map[edge[0]],node_map[edge[2]])
+                if edge[0] not in dead and edge[2] not in dead:
+                    yield k, (node_map[edge[0]],node_map[edge[2]])
         
         if rel is None:
             source_edges = gen_edges()
@@ -477,4 +734,54 @@ class Graph(object):
         self._local.dirty_nodes = set()
         self._local.dirty_edges = set()
         self._local.removed_nodes = set()
-        self._local.removed_edges = set()
\ No newline at end of file
+        self._local.removed_edges = set()
+
+
+
+class Snapshot(Graph):
+    """Read-only view of a graph as of one commit"""
+    
+    def __init__(self, graph):
+        self.graph = graph
+        self.storage = graph.storage.snapshot()
+        self.last_node_id = self.next_node_id = graph.last_node_id
+        self.adjacency = Adjacency(self.storage, graph.adjacency.threshold,
+            graph.adjacency.segment_size)
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        self._reset_change_buffers()
+        self._in_context = False
+        self._listeners = []
+        self.load_tombstones()
+        
+        
+    def _get_seq(self):
+        return self.storage.seq
+        
+    seq = property(_get_seq)
+    
+    
+    def release(self):
+        self.storage.release()
+        
+    close = release
+    
+        
+    def __enter__(self):
+        return self
+        
+        
+    def __exit__(self, exc, exc_type, tb):
+        self.release()
+        
+        
+    def dirty(self, item):
+        raise RuntimeError, "Snapshots are read-only"
+        
+        
+    def save(self):
+        raise RuntimeError, "Snapshots are read-only"
+        
+        
+    def restore(self, path):
+        raise RuntimeError, "Snapshots are read-only"
\ No newline at end of file
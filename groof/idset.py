@@ -0,0 +1,227 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Compact sets of node ids
+
+An IdSet stores node ids as a sorted array of 8 byte words instead of a
+Python object per id. Set operations merge the sorted arrays, switching to
+binary search when one side is much smaller than the other. Where arrays
+have no 8 byte typecode the ids are kept in a sorted list instead.
+"""
+
+from array import array
+from bisect import bisect_left
+
+
+# Node ids take 64 bits. 'L' is only 4 bytes where longs are 32 bit, as on 64
+# bit Windows, and arrays don't support 'Q' before Python 3.3. Without either
+# ID_TYPECODE is None and id_array makes lists.
+if array('L').itemsize == 8:
+    ID_TYPECODE = 'L'
+else:
+    try:
+        ID_TYPECODE = array('Q').typecode
+    except ValueError:
+        ID_TYPECODE = None
+
+# Bytes per id in an id array
+ID_SIZE = 8
+
+# Intersections and differences binary search the larger set for each member
+# of the smaller one when the sizes differ by more than this factor.
+GALLOP_RATIO = 32
+
+
+
+def id_array(ids=()):
+    """Make an array of node ids, or a list if there is no 8 byte typecode"""
+    if ID_TYPECODE is None:
+        return list(ids)
+    return array(ID_TYPECODE, ids)
+    
+    
+    
+class IdSet(object):
+
+    __slots__ = ('_ids',)
+    
+    def __init__(self, ids=()):
+        if isinstance(ids, IdSet):
+            self._ids = ids._ids
+        else:
+            self._ids = id_array(sorted(set(ids)))
+            
+            
+    def __len__(self):
+        return len(self._ids)
+        
+        
+    def __iter__(self):
+        return iter(self._ids)
+        
+        
+    def __contains__(self, id):
+        i = bisect_left(self._ids, id)
+        return i < len(self._ids) and self._ids[i] == id
+        
+        
+    def __eq__(self, other):
+        if not isinstance(other, IdSet):
+            other = IdSet(other)
+        return self._ids == other._ids
+        
+        
+    def __ne__(self, other):
+        return not self == other
+        
+        
+    def __repr__(self):
+        if len(self._ids) > 10:
+            return 'IdSet([%s, ...] %d ids)' % (
+                ', '.join([str(i) for i in self._ids[:10]]), len(self._ids))
+        return 'IdSet(%s)' % list(self._ids)
+        
+        
+    def union(self, other):
+        a, b = self._ids, _ids_of(other)
+        out = id_array()
+        i = j = 0
+        la, lb = len(a), len(b)
+        while i < la and j < lb:
+            x, y = a[i], b[j]
+            if x < y:
+                out.append(x)
+                i += 1
+            elif y < x:
+                out.append(y)
+                j += 1
+            else:
+                out.append(x)
+                i += 1
+                j += 1
+        out.extend(a[i:])
+        out.extend(b[j:])
+        return _from_sorted(out)
+        
+        
+    def intersection(self, other):
+        a, b = self._ids, _ids_of(other)
+        if len(a) > len(b):
+            a, b = b, a
+        if len(a) * GALLOP_RATIO < len(b):
+            return _from_sorted(id_array([x for x in a if _has(b, x)]))
+        out = id_array()
+        i = j = 0
+        la, lb = len(a), len(b)
+        while i < la and j < lb:
+            x, y = a[i], b[j]
+            if x < y:
+                i += 1
+            elif y < x:
+                j += 1
+            else:
+                out.append(x)
+                i += 1
+                j += 1
+        return _from_sorted(out)
+        
+        
+    def difference(self, other):
+        a, b = self._ids, _ids_of(other)
+        if len(b) * GALLOP_RATIO < len(a) or len(a) * GALLOP_RATIO < len(b):
+            return _from_sorted(id_array([x for x in a if not _has(b, x)]))
+        out = id_array()
+        i = j = 0
+        la, lb = len(a), len(b)
+        while i < la and j < lb:
+            x, y = a[i], b[j]
+            if x < y:
+                out.append(x)
+                i += 1
+            elif y < x:
+                j += 1
+            else:
+                i += 1
+                j += 1
+        out.extend(a[i:])
+        return _from_sorted(out)
+        
+        
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    
+    
+    def dumps(self):
+        """Encode as varint deltas"""
+        return pack_id_deltas(self._ids)
+        
+        
+        
+def loads(s):
+    """Decode an IdSet from a string made by IdSet.dumps"""
+    return _from_sorted(id_array(unpack_id_deltas(s)))
+    
+    
+def pack_id_deltas(ids):
+    """Encode a sorted sequence of ids as varint deltas"""
+    out = []
+    last = 0
+    for id in ids:
+        d = id - last
+        last = id
+        while d > 0x7f:
+            out.append(chr(0x80 | (d & 0x7f)))
+            d >>= 7
+        out.append(chr(d))
+    return ''.join(out)
+    
+    
+def unpack_id_deltas(s):
+    ids = []
+    last = 0
+    d = shift = 0
+    for c in s:
+        b = ord(c)
+        d |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            last += d
+            ids.append(last)
+            d = shift = 0
+    return ids
+    
+    
+def _from_sorted(ids):
+    s = IdSet()
+    s._ids = ids
+    return s
+    
+    
+def _ids_of(other):
+    if isinstance(other, IdSet):
+        return other._ids
+    return IdSet(other)._ids
+    
+    
+def _has(ids, id):
+    i = bisect_left(ids, id)
+    return i < len(ids) and ids[i] == id
\ No newline at end of file
@@ -0,0 +1,460 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Counters, timers and profiling hooks for the hot paths
+
+Nothing here runs until enable() is called: enable() swaps instrumented
+wrappers in for the methods listed in HOOKS and disable() puts the
+originals back, so a disabled process pays nothing.
+
+    stats = Stats()
+    enable(stats, SamplingSink(log_slow, threshold=0.05))
+    watch(g)        # also count storage reads and writes of g
+    ...
+    print stats.report()
+    disable()
+
+Every call of a hooked method is an Operation. An operation counts the
+storage probes (key lookups), scans (prefix and range scans, iterations),
+records scanned, bytes read and written, and writes made by the watched
+graphs while it runs, and its elapsed time. Counters of nested operations
+are added to the enclosing one as well, so they are inclusive. Storage use
+outside any operation is not counted. Finished operations are passed to
+every sink's record method.
+"""
+
+import random
+import socket
+import sys
+import threading
+import time
+import traceback
+import graph
+import query
+import traverse
+
+
+# (owner, attribute, operation name) of every hooked function
+HOOKS = [
+    (graph.Graph, '__getitem__', 'graph.get_node'),
+    (graph.Graph, 'get_edges', 'graph.get_edges'),
+    (graph.Graph, 'save', 'graph.save'),
+    (graph.Index, '__getitem__', 'index.get'),
+    (graph.Index, 'getmulti', 'index.getmulti'),
+    (traverse.Traverser, 'iter_ids', 'traverse.traversal'),
+    (traverse, 'k_hop', 'traverse.k_hop'),
+    (traverse, 'shortest_path', 'traverse.shortest_path'),
+    (query.Query, 'ids', 'query.run'),
+]
+
+GENERATORS = set(['traverse.traversal', 'query.run'])
+
+
+_sinks = []
+_originals = []
+_watched = []
+_local = threading.local()
+
+
+
+class Operation(object):
+
+    __slots__ = ('name', 'elapsed', 'probes', 'scans', 'records', 'bytes_read',
+        'writes', 'bytes_written', 'stack')
+        
+    counters = ('probes', 'scans', 'records', 'bytes_read', 'writes', 'bytes_written')
+    
+    def __init__(self, name):
+        self.name = name
+        self.elapsed = 0.0
+        self.probes = 0
+        self.scans = 0
+        self.records = 0
+        self.bytes_read = 0
+        self.writes = 0
+        self.bytes_written = 0
+        self.stack = None
+        
+        
+    def add(self, other):
+        for c in self.counters:
+            setattr(self, c, getattr(self, c) + getattr(other, c))
+            
+            
+    def __repr__(self):
+        return '<Operation %s %.6fs %s>' % (self.name, self.elapsed,
+            ' '.join(['%s=%d' % (c, getattr(self, c)) for c in self.counters]))
+            
+            
+            
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+        
+        
+def _current():
+    stack = _stack()
+    return stack[-1] if stack else None
+    
+    
+def _finish(op):
+    stack = _stack()
+    stack.remove(op)
+    if stack:
+        stack[-1].add(op)
+    for sink in _sinks:
+        sink.record(op)
+        
+        
+def _wrap(f, name):
+    def wrapper(*args, **kwargs):
+        op = Operation(name)
+        _stack().append(op)
+        started = time.time()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            op.elapsed = time.time() - started
+            _finish(op)
+    wrapper.__name__ = f.__name__
+    wrapper.__doc__ = f.__doc__
+    return wrapper
+    
+    
+def _wrap_generator(f, name):
+    # Only the time spent producing items is counted, not the consumer's
+    def wrapper(*args, **kwargs):
+        op = Operation(name)
+        stack = _stack()
+        stack.append(op)
+        try:
+            started = time.time()
+            try:
+                items = f(*args, **kwargs)
+            finally:
+                op.elapsed += time.time() - started
+                stack.remove(op)
+            while True:
+                stack.append(op)
+                started = time.time()
+                try:
+                    item = items.next()
+                except StopIteration:
+                    return
+                finally:
+                    op.elapsed += time.time() - started
+                    stack.remove(op)
+                yield item
+        finally:
+            stack.append(op)
+            _finish(op)
+    wrapper.__name__ = f.__name__
+    wrapper.__doc__ = f.__doc__
+    return wrapper
+    
+    
+def enable(*sinks):
+    """Install the hooks, sending finished operations to sinks"""
+    _sinks[:] = sinks
+    if _originals:
+        return
+    package = sys.modules.get('groof')
+    for owner, attr, name in HOOKS:
+        original = owner.__dict__[attr]
+        if name in GENERATORS:
+            wrapper = _wrap_generator(original, name)
+        else:
+            wrapper = _wrap(original, name)
+        setattr(owner, attr, wrapper)
+        _originals.append((owner, attr, original))
+        # Functions re-exported by the package
+        if package is not None and getattr(package, attr, None) is original:
+            setattr(package, attr, wrapper)
+            _originals.append((package, attr, original))
+            
+            
+def disable():
+    """Remove the hooks and stop counting the storage of watched graphs"""
+    for owner, attr, original in reversed(_originals):
+        setattr(owner, attr, original)
+    del _originals[:]
+    del _sinks[:]
+    for g in list(_watched):
+        unwatch(g)
+        
+        
+def is_enabled():
+    return bool(_originals)
+    
+    
+def watch(g):
+    """Count the storage reads and writes of graph g"""
+    if g in _watched:
+        return
+    g.storage.group = InstrumentedStorageGroup(g.storage.group)
+    _watched.append(g)
+    
+    
+def unwatch(g):
+    if g not in _watched:
+        return
+    g.storage.group = g.storage.group.group
+    _watched.remove(g)
+
+
+
+class InstrumentedStorage(object):
+    """Count the use of a store in the current operation"""
+    
+    def __init__(self, store):
+        self.store = store
+        
+        
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+        
+        
+    def __getitem__(self, k):
+        v = self.store[k]
+        op = _current()
+        if op is not None:
+            op.probes += 1
+            op.records += 1
+            op.bytes_read += len(v)
+        return v
+        
+        
+    def __contains__(self, k):
+        op = _current()
+        if op is not None:
+            op.probes += 1
+        return k in self.store
+        
+        
+    def __len__(self):
+        return len(self.store)
+        
+        
+    def getdup(self, k):
+        values = self.store.getdup(k)
+        op = _current()
+        if op is not None:
+            op.probes += 1
+            op.records += len(values)
+            op.bytes_read += sum([len(v) for v in values])
+        return values
+        
+        
+    def match_prefix(self, prefix, limit=-1):
+        return self._scanned(self.store.match_prefix(prefix, limit))
+        
+        
+    def range(self, start, stop=None, limit=-1):
+        return self._scanned(self.store.range(start, stop, limit))
+        
+        
+    def _scanned(self, keys):
+        op = _current()
+        if op is not None:
+            op.scans += 1
+            op.records += len(keys)
+        return keys
+        
+        
+    def __iter__(self):
+        op = _current()
+        if op is not None:
+            op.scans += 1
+        for k in self.store:
+            op = _current()
+            if op is not None:
+                op.records += 1
+            yield k
+            
+            
+    def iter_records(self):
+        op = _current()
+        if op is not None:
+            op.scans += 1
+        for k, v in self.store.iter_records():
+            op = _current()
+            if op is not None:
+                op.records += 1
+                op.bytes_read += len(v)
+            yield k, v
+            
+            
+    def __setitem__(self, k, v):
+        self._written(v)
+        self.store[k] = v
+        
+        
+    def setdup(self, k, v):
+        self._written(v)
+        self.store.setdup(k, v)
+        
+        
+    def __delitem__(self, k):
+        self._written('')
+        del self.store[k]
+        
+        
+    def deldup(self, k):
+        self._written('')
+        self.store.deldup(k)
+        
+        
+    def _written(self, v):
+        op = _current()
+        if op is not None:
+            op.writes += 1
+            op.bytes_written += len(v)
+
+
+
+class InstrumentedStorageGroup(object):
+    """Wrap each store of a group in an InstrumentedStorage"""
+    
+    def __init__(self, group):
+        self.group = group
+        self._wrapped = {}
+        
+        
+    def __getattr__(self, name):
+        v = getattr(self.group, name)
+        if name in self.group.storage_attrs:
+            return self._wrap(name, v)
+        return v
+        
+        
+    def get_index(self, name):
+        return self._wrap('index:' + name, self.group.get_index(name))
+        
+        
+    def _wrap(self, name, store):
+        # Stores may be replaced when the group is reopened
+        wrapped = self._wrapped.get(name)
+        if wrapped is None or wrapped.store is not store:
+            wrapped = self._wrapped[name] = InstrumentedStorage(store)
+        return wrapped
+
+
+
+class Stats(object):
+    """Aggregate operations in memory by name"""
+    
+    fields = ('count', 'time', 'max_time') + Operation.counters
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+        
+        
+    def reset(self):
+        self.ops = {}
+        
+        
+    def record(self, op):
+        self._lock.acquire()
+        try:
+            s = self.ops.get(op.name)
+            if s is None:
+                s = self.ops[op.name] = dict([(f, 0) for f in self.fields])
+            s['count'] += 1
+            s['time'] += op.elapsed
+            s['max_time'] = max(s['max_time'], op.elapsed)
+            for c in Operation.counters:
+                s[c] += getattr(op, c)
+        finally:
+            self._lock.release()
+            
+            
+    def report(self):
+        lines = ['%-24s %8s %10s %10s %8s %8s %10s %10s %8s %10s' % (
+            ('operation',) + self.fields)]
+        for name in sorted(self.ops):
+            s = self.ops[name]
+            lines.append('%-24s %8d %10.4f %10.4f %8d %8d %10d %10d %8d %10d' % (
+                (name,) + tuple([s[f] for f in self.fields])))
+        return '\n'.join(lines)
+
+
+
+class LineSink(object):
+    """Write each operation as statsd style lines, a timer in milliseconds
+    and a counter for each non-zero counter, to out"""
+    
+    def __init__(self, out=sys.stderr, prefix='groof'):
+        self.out = out
+        self.prefix = prefix
+        
+        
+    def lines(self, op):
+        name = '%s.%s' % (self.prefix, op.name)
+        lines = ['%s.time:%.3f|ms' % (name, op.elapsed * 1000)]
+        for c in Operation.counters:
+            n = getattr(op, c)
+            if n:
+                lines.append('%s.%s:%d|c' % (name, c, n))
+        return lines
+        
+        
+    def record(self, op):
+        self.out.write('\n'.join(self.lines(op)) + '\n')
+
+
+
+class StatsdSink(LineSink):
+    """Send the lines of LineSink to a statsd server over UDP"""
+    
+    def __init__(self, host='127.0.0.1', port=8125, prefix='groof'):
+        LineSink.__init__(self, None, prefix)
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        
+        
+    def record(self, op):
+        try:
+            self.sock.sendto('\n'.join(self.lines(op)), self.address)
+        except socket.error:
+            pass
+
+
+
+class SamplingSink(object):
+    """Call callback with a random sample of operations, plus every operation
+    slower than threshold seconds. Each passed operation carries the stack it
+    was called from."""
+    
+    def __init__(self, callback, rate=0.01, threshold=None):
+        self.callback = callback
+        self.rate = rate
+        self.threshold = threshold
+        
+        
+    def record(self, op):
+        if random.random() < self.rate or (
+                self.threshold is not None and op.elapsed >= self.threshold):
+            op.stack = traceback.extract_stack()[:-3]
+            self.callback(op)
\ No newline at end of file
@@ -0,0 +1,86 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Key encoding for the node, left and right stores"""
+
+import struct
+
+
+OUTGOING = 0
+INCOMING = 1
+BOTH = 2
+
+
+# Keys are big-endian so that the byte order of the B-trees follows numeric
+# id order. This makes id range scans meaningful and lets sequential ids share
+# key prefixes, which the page compression of the stores takes advantage of.
+KEY_FORMAT_VERSION = 1
+NODE_KEY_FORMAT = '>Q'
+NODE_KEY_SIZE = struct.calcsize(NODE_KEY_FORMAT)
+REL_FORMAT = '>I'
+REL_SIZE = struct.calcsize(REL_FORMAT)
+EDGE_KEY_FORMAT = '>QIQ'
+EDGE_KEY_SIZE = struct.calcsize(EDGE_KEY_FORMAT)
+EDGE_KEY_PREFIX_FORMAT = '>QI'
+
+# The node store keeps the key format version and the next node id under the
+# key of node 0, which sorts before every real node. Graphs written before key
+# formats were versioned used a 4 byte native int key instead.
+META_FORMAT = '>HQ'
+LEGACY_META_KEY = struct.pack('i', 0)
+
+
+def pack_node_key(id):
+    return struct.pack(NODE_KEY_FORMAT, id)
+    
+    
+def unpack_node_key(s):
+    return struct.unpack(NODE_KEY_FORMAT, s)[0]
+    
+    
+def pack_edge_key(left_id, rel, right_id):
+    return struct.pack(EDGE_KEY_FORMAT, left_id, rel, right_id)
+    
+    
+def unpack_edge_key(s):
+    return struct.unpack(EDGE_KEY_FORMAT, s)
+    
+    
+def invert_edge_key(edge_key_string):
+    return edge_key_string[REL_SIZE+NODE_KEY_SIZE:]+\
+        edge_key_string[NODE_KEY_SIZE:NODE_KEY_SIZE+REL_SIZE]+\
+        edge_key_string[:NODE_KEY_SIZE]
+        
+        
+def pack_edge_key_prefix(node_id, rel):
+    if rel is None:
+        return pack_node_key(node_id)
+    return struct.pack(EDGE_KEY_PREFIX_FORMAT, node_id, rel)
+
+
+META_KEY = pack_node_key(0)
+
+
+def pack_meta(next_node_id):
+    return struct.pack(META_FORMAT, KEY_FORMAT_VERSION, next_node_id)
+    
+    
+def unpack_meta(s):
+    return struct.unpack(META_FORMAT, s)
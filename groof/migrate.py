@@ -0,0 +1,157 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Offline conversion of graph storage between key formats
+
+Graphs written before key formats were versioned (format 0) use native
+byte order struct keys. On little-endian machines their B-tree order does not
+follow node id order, and their edge keys carry alignment padding. The
+inverted keys in their right store are also misaligned, so the right store is
+rebuilt from the left store rather than copied.
+
+Migration must run while no other process has the graph open:
+
+    python -m groof.migrate /path/to/graph
+"""
+
+import os
+import struct
+import sys
+from keys import (
+    META_KEY, LEGACY_META_KEY, KEY_FORMAT_VERSION, pack_meta, unpack_meta,
+    pack_node_key, pack_edge_key, invert_edge_key
+)
+
+
+LEGACY_NODE_KEY_FORMAT = 'Q'
+LEGACY_EDGE_KEY_FORMAT = 'QIQ'
+
+# Records are copied in transactions of this many writes
+BATCH_SIZE = 10000
+
+
+
+def key_format_version(storage):
+    """Get the key format version of a storage group"""
+    try:
+        return unpack_meta(storage.node[META_KEY])[0]
+    except KeyError:
+        if LEGACY_META_KEY in storage.node:
+            return 0
+        return KEY_FORMAT_VERSION
+        
+        
+def migrate(path, storage_factory=None):
+    """Convert the graph at path to the current key format. The converted
+    graph is written next to the original, then swapped in; the original is
+    kept at path + '.v<old version>'. Returns the old version."""
+    if storage_factory is None:
+        from storage.tc import TokyoCabinetStorageGroup as storage_factory
+    path = path.rstrip(os.sep)
+    old = storage_factory(path)
+    try:
+        version = key_format_version(old)
+        if version == KEY_FORMAT_VERSION:
+            return version
+        if version != 0:
+            raise RuntimeError, "Don't know how to migrate key format %d" % version
+        tmp_path = path + '.migrating'
+        if os.path.exists(tmp_path):
+            raise RuntimeError, "%s exists, remove it before migrating" % tmp_path
+        new = storage_factory(tmp_path)
+        try:
+            _migrate_legacy(old, new)
+        finally:
+            new.close()
+    finally:
+        old.close()
+    os.rename(path, '%s.v%d' % (path, version))
+    os.rename(tmp_path, path)
+    return version
+    
+    
+def _migrate_legacy(old, new):
+    batch = _Batch(new)
+    next_node_id = 0
+    for k, v in old.node.iter_records():
+        if k == LEGACY_META_KEY:
+            next_node_id = struct.unpack(LEGACY_NODE_KEY_FORMAT, v)[0]
+            continue
+        node_id = struct.unpack(LEGACY_NODE_KEY_FORMAT, k)[0]
+        batch.set(new.node, pack_node_key(node_id), v)
+    for k, v in old.left.iter_records():
+        k = pack_edge_key(*struct.unpack(LEGACY_EDGE_KEY_FORMAT, k))
+        batch.set(new.left, k, v)
+        batch.set(new.right, invert_edge_key(k), '')
+    for name in old.index_names():
+        batch.commit()
+        index = new.get_index(name)
+        for k, v in old.get_index(name).iter_records():
+            node_id = struct.unpack(LEGACY_NODE_KEY_FORMAT, v)[0]
+            batch.setdup(index, k, pack_node_key(node_id))
+    batch.set(new.node, META_KEY, pack_meta(next_node_id))
+    batch.commit()
+
+
+
+class _Batch(object):
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.size = 0
+        
+        
+    def set(self, store, k, v):
+        self._write()
+        store[k] = v
+        
+        
+    def setdup(self, store, k, v):
+        self._write()
+        store.setdup(k, v)
+        
+        
+    def commit(self):
+        if self.size > 0:
+            self.storage.commit_txn()
+            self.size = 0
+            
+            
+    def _write(self):
+        if self.size == 0:
+            self.storage.start_txn()
+        self.size += 1
+        if self.size >= BATCH_SIZE:
+            self.storage.commit_txn()
+            self.storage.start_txn()
+            self.size = 1
+
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print >>sys.stderr, "usage: python -m groof.migrate PATH"
+        sys.exit(2)
+    version = migrate(sys.argv[1])
+    if version == KEY_FORMAT_VERSION:
+        print "%s already uses key format %d" % (sys.argv[1], version)
+    else:
+        print "Migrated %s from key format %d to %d" % (
+            sys.argv[1], version, KEY_FORMAT_VERSION)
\ No newline at end of file
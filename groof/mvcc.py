@@ -0,0 +1,585 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Point-in-time snapshots of a storage group
+
+Graph.save commits to every store of a group in turn, so a plain reader can
+see a node before its edges land. VersionedStorageGroup wraps a group and,
+while any snapshot is open, saves the before-image of each record the first
+time a commit overwrites it. A snapshot taken at commit sequence n reads a
+key from the oldest image saved by a later commit, or from the store when
+no later commit has touched it, so it never sees a partial or newer write.
+
+Images are kept in memory and are dropped as soon as no open snapshot is
+older than the commit that saved them. Nothing is recorded while no
+snapshot is open. Snapshots are only consistent with writes made through
+the same VersionedStorageGroup, i.e. within one process. Transactions are
+per thread, and a write made outside one is committed on its own.
+
+Once a generation has been started with begin_generation(), the group also
+keeps a change journal in the journal store: every write adds the written
+store and key under the current generation, in the same transaction as
+the write. Incremental backups read the keys changed in past generations
+from it.
+"""
+
+import bisect
+import struct
+import threading
+
+
+# Image of a key that did not exist
+ABSENT = None
+
+# Records of the journal store
+JOURNAL_GENERATION_KEY = 'g'
+JOURNAL_CHANGE_PREFIX = 'c'
+
+# Snapshot stores are iterated this many keys at a time
+ITER_PAGE_SIZE = 1000
+
+
+
+def pack_journal_key(generation, name, k):
+    return '%s%s%s\x00%s' % (JOURNAL_CHANGE_PREFIX, struct.pack('>I', generation), name, k)
+    
+    
+def unpack_journal_key(s):
+    """Get (generation, store name, key) from a journal key"""
+    name, k = s[5:].split('\x00', 1)
+    return struct.unpack('>I', s[1:5])[0], name, k
+    
+    
+def _image(store, k):
+    if k not in store:
+        return ABSENT
+    if hasattr(store, 'getdup'):
+        return list(store.getdup(k))
+    return [store[k]]
+
+
+
+class Transaction(object):
+    """A thread's transaction. images is None if it records nothing."""
+    
+    __slots__ = ('images', 'depth')
+    
+    def __init__(self, images):
+        self.images = images
+        self.depth = 1
+
+
+
+class VersionLog(object):
+    """Before-images saved by the commits that snapshots may still need.
+    Transactions belong to the thread that began them."""
+    
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._done = threading.Condition(self.lock)
+        self.seq = 0
+        self._local = threading.local()
+        self._active = {}
+        self._unrecorded = 0
+        self._opening = 0
+        self._seqs = []
+        self._undo = []
+        self._open = {}
+        self._next_token = 0
+        self.generation = None
+        
+        
+    def _get_txn(self):
+        return getattr(self._local, 'txn', None)
+        
+    txn = property(_get_txn)
+    
+    
+    def _get_in_txn(self):
+        return self.txn is not None
+        
+    in_txn = property(_get_in_txn)
+    
+    
+    def begin(self):
+        self.lock.acquire()
+        try:
+            txn = self.txn
+            if txn is not None:
+                txn.depth += 1
+                return
+            txn = Transaction({} if self._open or self._opening else None)
+            if txn.images is None:
+                self._unrecorded += 1
+            else:
+                self._active[id(txn)] = txn.images
+            self._local.txn = txn
+        finally:
+            self.lock.release()
+            
+            
+    def commit(self):
+        self.lock.acquire()
+        try:
+            txn = self.txn
+            if txn is None:
+                return
+            txn.depth -= 1
+            if txn.depth > 0:
+                return
+            self._end(txn)
+            self.seq += 1
+            if txn.images:
+                self._seqs.append(self.seq)
+                self._undo.append(txn.images)
+        finally:
+            self.lock.release()
+            
+            
+    def abort(self):
+        self.lock.acquire()
+        try:
+            if self.txn is not None:
+                self._end(self.txn)
+        finally:
+            self.lock.release()
+            
+            
+    def _end(self, txn):
+        self._local.txn = None
+        if txn.images is None:
+            self._unrecorded -= 1
+            if self._unrecorded == 0:
+                self._done.notifyAll()
+        else:
+            del self._active[id(txn)]
+            
+            
+    def record(self, name, store, k):
+        """Save the current image of k before the calling thread's transaction
+        writes it. The caller holds the lock."""
+        images = self.txn.images
+        if images is not None:
+            images = images.setdefault(name, {})
+            if k not in images:
+                images[k] = _image(store, k)
+                
+                
+    def open(self):
+        """Register a snapshot of the last commit and return (token, seq)"""
+        self.lock.acquire()
+        try:
+            txn = self.txn
+            if txn is not None and txn.images is None:
+                raise RuntimeError, "Can't take a snapshot during a commit"
+            # Transactions begun from now on record images. Wait for the
+            # ones that don't to finish.
+            self._opening += 1
+            try:
+                while self._unrecorded:
+                    self._done.wait()
+            finally:
+                self._opening -= 1
+            token = self._next_token
+            self._next_token += 1
+            self._open[token] = self.seq
+            return token, self.seq
+        finally:
+            self.lock.release()
+            
+            
+    def release(self, token):
+        self.lock.acquire()
+        try:
+            if self._open.pop(token, None) is None:
+                return
+            if self._open:
+                n = bisect.bisect_right(self._seqs, min(self._open.values()))
+            else:
+                n = len(self._seqs)
+            del self._seqs[:n]
+            del self._undo[:n]
+        finally:
+            self.lock.release()
+            
+            
+    def num_images(self):
+        return sum([len(images) for undo in self._undo for images in undo.values()])
+        
+        
+    def changes(self, name, seq):
+        """Get the images of the keys of a store written after seq as a dict.
+        The caller holds the lock."""
+        changes = {}
+        for undo in self._after(seq):
+            for k, image in undo.get(name, {}).iteritems():
+                changes.setdefault(k, image)
+        return changes
+        
+        
+    def lookup(self, name, k, seq):
+        """Get (True, image) if k was written after seq, else (False, None).
+        The caller holds the lock."""
+        for undo in self._after(seq):
+            images = undo.get(name)
+            if images is not None and k in images:
+                return True, images[k]
+        return False, None
+        
+        
+    def _after(self, seq):
+        undo = self._undo[bisect.bisect_right(self._seqs, seq):]
+        undo.extend(self._active.values())
+        return undo
+
+
+
+class VersionedStorage(object):
+    """Record before-images of a store's records as they are written. Reads
+    go straight to the store."""
+    
+    def __init__(self, log, name, resolve, journal=None):
+        self._log = log
+        self._name = name
+        self._resolve = resolve
+        self._journal = journal
+        
+        
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+        
+        
+    def __getitem__(self, k):
+        return self._resolve()[k]
+        
+        
+    def __contains__(self, k):
+        return k in self._resolve()
+        
+        
+    def __len__(self):
+        return len(self._resolve())
+        
+        
+    def __iter__(self):
+        return iter(self._resolve())
+        
+        
+    def __setitem__(self, k, v):
+        self._write(k, '__setitem__', k, v)
+        
+        
+    def __delitem__(self, k):
+        self._write(k, '__delitem__', k)
+        
+        
+    def setdup(self, k, v):
+        self._write(k, 'setdup', k, v)
+        
+        
+    def deldup(self, k):
+        self._write(k, 'deldup', k)
+        
+        
+    def _write(self, k, method, *args):
+        log = self._log
+        store = self._resolve()
+        # A write outside a transaction is a commit of its own. The store's
+        # transaction is begun first so the image is read once this thread
+        # may write.
+        auto = not log.in_txn
+        if auto:
+            store.start_txn()
+            log.begin()
+        try:
+            log.lock.acquire()
+            try:
+                log.record(self._name, store, k)
+            finally:
+                log.lock.release()
+            getattr(store, method)(*args)
+            if log.generation is not None and self._journal is not None:
+                self._journal()[pack_journal_key(log.generation, self._name, k)] = ''
+        except:
+            if auto:
+                try:
+                    store.abort_txn()
+                finally:
+                    log.abort()
+            raise
+        if auto:
+            log.lock.acquire()
+            try:
+                store.commit_txn()
+                log.commit()
+            finally:
+                log.lock.release()
+
+
+
+class VersionedStorageGroup(object):
+    """Wrap a storage group so snapshots of it can be taken"""
+    
+    def __init__(self, group):
+        self.group = group
+        self.log = VersionLog()
+        journal = self._resolver('journal')
+        for n in group.storage_attrs:
+            setattr(self, n, VersionedStorage(self.log, n, self._resolver(n),
+                None if n == 'journal' else journal))
+        self._indices = {}
+        try:
+            self.log.generation = struct.unpack('>I', group.journal[JOURNAL_GENERATION_KEY])[0]
+        except KeyError:
+            pass
+        
+        
+    def __getattr__(self, name):
+        return getattr(self.group, name)
+        
+        
+    def _resolver(self, name):
+        return lambda: getattr(self.group, name)
+        
+        
+    def get_index(self, name):
+        if name not in self._indices:
+            self._indices[name] = VersionedStorage(self.log, 'index:' + name,
+                lambda: self.group.get_index(name), self._resolver('journal'))
+        return self._indices[name]
+        
+        
+    def start_txn(self):
+        # Beginning may wait for another thread's transaction, so it is done
+        # without the log's lock
+        self.group.start_txn()
+        self.log.begin()
+        
+        
+    def abort_txn(self):
+        try:
+            self.group.abort_txn()
+        finally:
+            self.log.abort()
+            
+            
+    def commit_txn(self):
+        # Committing a transaction this thread holds doesn't wait on others,
+        # and under the lock no snapshot sees the commit half done
+        self.log.lock.acquire()
+        try:
+            self.group.commit_txn()
+            self.log.commit()
+        finally:
+            self.log.lock.release()
+            
+            
+    def snapshot(self):
+        return SnapshotStorageGroup(self)
+        
+        
+    def begin_generation(self):
+        """Start journaling changes under a new generation and return it. The
+        caller makes sure no commit is in progress."""
+        journal = self.group.journal
+        journal.start_txn()
+        self.log.lock.acquire()
+        try:
+            try:
+                generation = (self.log.generation or 0) + 1
+                journal[JOURNAL_GENERATION_KEY] = struct.pack('>I', generation)
+                journal.commit_txn()
+            except:
+                journal.abort_txn()
+                raise
+            self.log.generation = generation
+            return generation
+        finally:
+            self.log.lock.release()
+            
+            
+    def journal_keys(self, until):
+        """Get the journal keys of changes made before generation until"""
+        return self.group.journal.range(JOURNAL_CHANGE_PREFIX,
+            pack_journal_key(until, '', ''))
+
+
+
+class SnapshotStorage(object):
+    """Read-only view of a store as of a commit sequence"""
+    
+    def __init__(self, log, name, resolve, seq):
+        self._log = log
+        self._name = name
+        self._resolve = resolve
+        self._seq = seq
+        
+        
+    def __getitem__(self, k):
+        image = self._get(k)
+        if image is ABSENT:
+            raise KeyError, k
+        return image[0]
+        
+        
+    def __contains__(self, k):
+        return self._get(k) is not ABSENT
+        
+        
+    def getdup(self, k):
+        image = self._get(k)
+        if image is ABSENT:
+            raise KeyError, k
+        return list(image)
+        
+        
+    def __len__(self):
+        store = self._resolve()
+        self._log.lock.acquire()
+        try:
+            n = len(store)
+            for k, image in self._log.changes(self._name, self._seq).iteritems():
+                n += len(image or []) - len(_image(store, k) or [])
+            return n
+        finally:
+            self._log.lock.release()
+            
+            
+    def range(self, start, stop=None, limit=-1):
+        return self._scan(lambda s, n: s.range(start, stop, n),
+            lambda k: k >= start and (stop is None or k < stop), limit)
+            
+            
+    def match_prefix(self, prefix, limit=-1):
+        return self._scan(lambda s, n: s.match_prefix(prefix, n),
+            lambda k: k.startswith(prefix), limit)
+            
+            
+    def __iter__(self):
+        start = ''
+        while start is not None:
+            keys, start = self._page(start)
+            for k in keys:
+                yield k
+                
+                
+    def iter_records(self):
+        for k in self:
+            try:
+                values = self.getdup(k)
+            except KeyError:
+                continue
+            for v in values:
+                yield k, v
+                
+                
+    def _get(self, k):
+        store = self._resolve()
+        self._log.lock.acquire()
+        try:
+            found, image = self._log.lookup(self._name, k, self._seq)
+            if found:
+                return image
+            return _image(store, k)
+        finally:
+            self._log.lock.release()
+            
+            
+    def _scan(self, scan, match, limit):
+        store = self._resolve()
+        self._log.lock.acquire()
+        try:
+            changes = self._log.changes(self._name, self._seq)
+            # Read enough extra keys to make up for ones that didn't exist yet
+            n = limit if limit < 0 else limit + len(changes)
+            keys = set([k for k in scan(store, n) if k not in changes])
+        finally:
+            self._log.lock.release()
+        keys.update([k for k, image in changes.iteritems()
+            if image is not ABSENT and match(k)])
+        keys = sorted(keys)
+        return keys if limit < 0 else keys[:limit]
+        
+        
+    def _page(self, start):
+        """Get the keys from start up to the end of one page of the store, and
+        where the next page starts or None after the last page. Pages are
+        bounded by the keys the store returned rather than by their number,
+        since stores may count duplicates of a key separately."""
+        store = self._resolve()
+        self._log.lock.acquire()
+        try:
+            changes = self._log.changes(self._name, self._seq)
+            scanned = store.range(start, None, ITER_PAGE_SIZE)
+        finally:
+            self._log.lock.release()
+        if len(scanned) < ITER_PAGE_SIZE:
+            end = None
+        else:
+            end = scanned[-1]
+        keys = set([k for k in scanned if k not in changes])
+        keys.update([k for k, image in changes.iteritems() if image is not ABSENT
+            and k >= start and (end is None or k <= end)])
+        return sorted(keys), None if end is None else end + '\x00'
+        
+        
+    def _read_only(self, *args):
+        raise RuntimeError, "Snapshots are read-only"
+        
+    __setitem__ = __delitem__ = setdup = deldup = _read_only
+
+
+
+class SnapshotStorageGroup(object):
+    """Storage group view of the last commit made through a
+    VersionedStorageGroup. Call release() when done with it."""
+    
+    def __init__(self, versioned):
+        self.versioned = versioned
+        self._token = None
+        self._token, self.seq = versioned.log.open()
+        self.storage_attrs = versioned.group.storage_attrs
+        for n in self.storage_attrs:
+            setattr(self, n, SnapshotStorage(versioned.log, n,
+                versioned._resolver(n), self.seq))
+        self._indices = {}
+        
+        
+    def __del__(self):
+        self.release()
+        
+        
+    def get_index(self, name):
+        if name not in self._indices:
+            group = self.versioned.group
+            self._indices[name] = SnapshotStorage(self.versioned.log,
+                'index:' + name, lambda: group.get_index(name), self.seq)
+        return self._indices[name]
+        
+        
+    def index_names(self):
+        return self.versioned.group.index_names()
+        
+        
+    def release(self):
+        if self._token is not None:
+            self.versioned.log.release(self._token)
+            self._token = None
\ No newline at end of file
@@ -0,0 +1,379 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""A pool of graphs sharing a bounded number of open storage groups
+
+Every open storage group holds a file handle per store and index, plus page
+caches and mapped memory. A process serving many small graphs can't keep
+them all open, so GraphPool keeps the most recently used max_open groups
+open and closes the least recently used one when another is needed. A
+graph whose group was closed reopens it the next time it is read or
+written. Groups with an open transaction, of the group or of one of its
+stores, are never closed.
+
+    pool = GraphPool(max_open=256, backend='tc', cache_size=4 << 20)
+    g = pool.graph('/var/graphs/tenant-42')
+    with g:
+        g.create_node(name='x')
+
+A group is never closed while a thread is in the middle of a call on it
+or of an iteration over one of its stores, nor during a transaction. If
+every open group is in use, more than max_open are open until some are
+no longer used.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from graph import Graph
+from storage.abstract import IStorageGroup
+
+
+
+def _storage_factory(backend):
+    if backend == 'tc':
+        from storage.tc import TokyoCabinetStorageGroup
+        return TokyoCabinetStorageGroup
+    elif backend == 'sqlite':
+        from storage.sqlite import SQLiteStorageGroup
+        return SQLiteStorageGroup
+    raise ValueError, "Unknown storage backend: %s" % backend
+
+
+
+class PooledStorage(object):
+    """A store of a PooledStorageGroup. Its group is kept open for the length
+    of every call."""
+    
+    def __init__(self, pooled, name):
+        self._pooled = pooled
+        self._name = name
+        
+        
+    def _store(self, group):
+        if self._name.startswith('index:'):
+            return group.get_index(self._name[6:])
+        return getattr(group, self._name)
+        
+        
+    def _call(self, method, *args):
+        pool = self._pooled.pool
+        group = pool._checkout(self._pooled)
+        try:
+            return getattr(self._store(group), method)(*args)
+        finally:
+            pool._checkin(self._pooled)
+            
+            
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError, name
+        return lambda *args: self._call(name, *args)
+        
+        
+    def start_txn(self):
+        self._pooled._count_txn(1)
+        try:
+            self._call('start_txn')
+        except:
+            self._pooled._count_txn(-1)
+            raise
+            
+            
+    def abort_txn(self):
+        try:
+            self._call('abort_txn')
+        finally:
+            self._pooled._count_txn(-1)
+            
+            
+    def commit_txn(self):
+        try:
+            self._call('commit_txn')
+        finally:
+            self._pooled._count_txn(-1)
+            
+            
+    def __getitem__(self, k):
+        return self._call('__getitem__', k)
+        
+        
+    def __setitem__(self, k, v):
+        self._call('__setitem__', k, v)
+        
+        
+    def __delitem__(self, k):
+        self._call('__delitem__', k)
+        
+        
+    def __contains__(self, k):
+        return self._call('__contains__', k)
+        
+        
+    def __len__(self):
+        return self._call('__len__')
+        
+        
+    def __iter__(self):
+        return self._iter('__iter__')
+        
+        
+    def iter_records(self):
+        return self._iter('iter_records')
+        
+        
+    def _iter(self, method):
+        pool = self._pooled.pool
+        group = pool._checkout(self._pooled)
+        try:
+            for item in getattr(self._store(group), method)():
+                yield item
+        finally:
+            pool._checkin(self._pooled)
+
+
+
+class PooledStorageGroup(object):
+    """A storage group that is opened when used and may be closed by its pool
+    when idle"""
+    
+    storage_attrs = IStorageGroup.storage_attrs
+    
+    
+    def __init__(self, pool, path):
+        self.pool = pool
+        self.path = path
+        self.txn_depth = 0
+        self.users = 0
+        self._group = None
+        self._indices = {}
+        for n in self.storage_attrs:
+            setattr(self, n, PooledStorage(self, n))
+            
+            
+    def _call(self, method, *args):
+        group = self.pool._checkout(self)
+        try:
+            return getattr(group, method)(*args)
+        finally:
+            self.pool._checkin(self)
+            
+            
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError, name
+        group = self.pool._checkout(self)
+        try:
+            value = getattr(group, name)
+        finally:
+            self.pool._checkin(self)
+        if callable(value):
+            return lambda *args: self._call(name, *args)
+        return value
+        
+        
+    def get_index(self, name):
+        if name not in self._indices:
+            self._indices[name] = PooledStorage(self, 'index:' + name)
+        return self._indices[name]
+        
+        
+    def index_names(self):
+        return self._call('index_names')
+        
+        
+    def start_txn(self):
+        self._count_txn(1)
+        try:
+            self._call('start_txn')
+        except:
+            self._count_txn(-1)
+            raise
+            
+            
+    def abort_txn(self):
+        try:
+            self._call('abort_txn')
+        finally:
+            self._count_txn(-1)
+            
+            
+    def commit_txn(self):
+        try:
+            self._call('commit_txn')
+        finally:
+            self._count_txn(-1)
+            
+            
+    def _count_txn(self, n):
+        """Count the transactions open on the group or on one of its stores.
+        The count is raised before a transaction begins and lowered after it
+        ends, so the pool never sees an open one as idle."""
+        self.pool._lock.acquire()
+        try:
+            self.txn_depth = max(0, self.txn_depth + n)
+        finally:
+            self.pool._lock.release()
+        
+        
+    def open(self):
+        self._call('open')
+        
+        
+    def close(self):
+        self.pool._close(self)
+
+
+
+class GraphPool(object):
+    """Graphs by path, with at most max_open storage groups open. cache_size
+    and mmap_size are passed to each storage group, so the total is capped
+    at max_open times their value."""
+    
+    def __init__(self, max_open=128, backend='tc', cache_size=None,
+            mmap_size=None, storage_factory=None):
+        self.max_open = max_open
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.storage_factory = storage_factory or _storage_factory(backend)
+        self.opens = 0
+        self.evictions = 0
+        self._graphs = {}
+        self._open = OrderedDict()
+        self._lock = threading.RLock()
+        
+        
+    def graph(self, path):
+        """Get the graph stored at path, creating it if necessary"""
+        path = os.path.abspath(path)
+        self._lock.acquire()
+        try:
+            if path not in self._graphs:
+                self._graphs[path] = Graph(PooledStorageGroup(self, path))
+            return self._graphs[path]
+        finally:
+            self._lock.release()
+            
+            
+    def __len__(self):
+        return len(self._graphs)
+        
+        
+    def num_open(self):
+        return len(self._open)
+        
+        
+    def stats(self):
+        return dict(
+            graphs = len(self._graphs),
+            open = len(self._open),
+            opens = self.opens,
+            evictions = self.evictions
+        )
+        
+        
+    def discard(self, path):
+        """Close the graph at path and forget it"""
+        path = os.path.abspath(path)
+        self._lock.acquire()
+        try:
+            g = self._graphs.pop(path, None)
+            if g is not None:
+                g.close()
+        finally:
+            self._lock.release()
+            
+            
+    def close(self):
+        """Close every open storage group. Graphs reopen them when used."""
+        self._lock.acquire()
+        try:
+            for pooled in self._open.keys():
+                self._close(pooled)
+        finally:
+            self._lock.release()
+            
+            
+    def _checkout(self, pooled):
+        """Get the open group of pooled, which is kept open until _checkin"""
+        self._lock.acquire()
+        try:
+            pooled.users += 1
+            if pooled._group is not None:
+                # Mark as most recently used
+                del self._open[pooled]
+                self._open[pooled] = True
+                return pooled._group
+            try:
+                self._evict(self.max_open - 1)
+                pooled._group = self._open_group(pooled.path)
+            except:
+                pooled.users -= 1
+                raise
+            self._open[pooled] = True
+            self.opens += 1
+            return pooled._group
+        finally:
+            self._lock.release()
+            
+            
+    def _checkin(self, pooled):
+        self._lock.acquire()
+        try:
+            pooled.users -= 1
+        finally:
+            self._lock.release()
+            
+            
+    def _open_group(self, path):
+        kwargs = {}
+        if self.cache_size is not None:
+            kwargs['cache_size'] = self.cache_size
+        if self.mmap_size is not None:
+            kwargs['mmap_size'] = self.mmap_size
+        return self.storage_factory(path, **kwargs)
+        
+        
+    def _evict(self, n):
+        """Close least recently used groups until at most n are open"""
+        for pooled in self._open.keys():
+            if len(self._open) <= n:
+                break
+            if pooled.txn_depth == 0 and pooled.users == 0:
+                self._close(pooled)
+                self.evictions += 1
+                
+                
+    def _close(self, pooled):
+        self._lock.acquire()
+        try:
+            if pooled._group is None:
+                return
+            if pooled.txn_depth:
+                raise RuntimeError, "Can't close %s during a transaction" % pooled.path
+            if pooled.users:
+                raise RuntimeError, "Can't close %s while it is in use" % pooled.path
+            group = pooled._group
+            pooled._group = None
+            del self._open[pooled]
+            group.close()
+        finally:
+            self._lock.release()
\ No newline at end of file
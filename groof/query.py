@@ -0,0 +1,357 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Declarative pattern queries
+
+A query is a set of named node patterns joined by rel hops. Node patterns may
+be constrained by id, by an index key and by attribute predicates. Before
+running, the planner picks a start node and an order for the hops using index
+cardinality and degree counts, and decides for each hop whether to read the
+left (outgoing) or the right (incoming) store.
+
+    q = query(g)
+    q.node('a', id=hub.id).node('b', index='byname', key='leaf')
+    q.rel('a', FOLLOWS, 'x').rel('b', FOLLOWS, 'x').limit(10)
+    print q.explain()
+    for match in q:
+        print match['x']['name']
+"""
+
+from graph import OUTGOING, INCOMING
+
+
+# Candidate sets at most this large have the degree of every candidate
+# probed while planning. Larger sets use the average degree of the graph.
+PROBE_CANDIDATES = 16
+
+# Degree probes stop counting here so planning never scans a whole supernode.
+DEGREE_PROBE_LIMIT = 10000
+
+
+
+class NodePattern(object):
+
+    def __init__(self, name, id=None, index=None, key=None, where=None):
+        if index is not None and key is None:
+            raise ValueError, "An index constraint requires a key"
+        self.name = name
+        self.id = id
+        self.index = index
+        self.key = key
+        self.where = where
+        
+        
+    def has_source(self):
+        return self.id is not None or self.index is not None
+        
+        
+    def describe(self):
+        if self.id is not None:
+            return 'id %s' % self.id
+        elif self.index is not None:
+            return 'index %s[%r]' % (self.index, self.key)
+        return 'all nodes'
+
+
+
+class RelPattern(object):
+
+    def __init__(self, left, rel, right):
+        self.left = left
+        self.rel = rel
+        self.right = right
+        
+        
+    def other(self, name):
+        return self.right if name == self.left else self.left
+        
+        
+    def describe(self, start):
+        rel = '*' if self.rel is None else self.rel
+        if start == self.left:
+            return '%s -[%s]-> %s' % (self.left, rel, self.right)
+        return '%s <-[%s]- %s' % (self.right, rel, self.left)
+
+
+
+class Step(object):
+    """One step of a query plan. Kind is one of scan, expand or check."""
+    
+    def __init__(self, kind, var, hop=None, direction=None, rows=None):
+        self.kind = kind
+        self.var = var
+        self.hop = hop
+        self.direction = direction
+        self.rows = rows
+        
+        
+    def describe(self, patterns):
+        if self.kind == 'scan':
+            s = 'scan %s: %s' % (self.var, patterns[self.var].describe())
+        elif self.kind == 'expand':
+            s = 'expand %s using %s store' % (
+                self.hop.describe(self.hop.other(self.var)),
+                'left' if self.direction is OUTGOING else 'right')
+        else:
+            s = 'check %s using left store' % self.hop.describe(self.hop.left)
+        if self.rows is not None:
+            s += ' (est. %d rows)' % self.rows
+        return s
+
+
+
+class Query(object):
+
+    def __init__(self, graph):
+        self._graph = graph
+        self._nodes = {}
+        self._order = []
+        self._hops = []
+        self._limit = None
+        self._plan = None
+        self._cost = None
+        
+        
+    def node(self, name, id=None, index=None, key=None, where=None):
+        """Add or constrain the node pattern called name.
+        
+        where may be a dict of attribute values to match or a callable that
+        takes a Node and returns True to accept it.
+        """
+        if name in self._nodes:
+            raise ValueError, "Node pattern %s already defined" % name
+        self._nodes[name] = NodePattern(name, id, index, key, where)
+        self._order.append(name)
+        self._plan = None
+        return self
+        
+        
+    def rel(self, a, rel, b, direction=OUTGOING):
+        """Require an edge with type rel between the patterns a and b. The edge
+        goes from a to b unless direction is INCOMING. A rel of None matches
+        edges of any type."""
+        for name in (a, b):
+            if name not in self._nodes:
+                self.node(name)
+        if direction is OUTGOING:
+            self._hops.append(RelPattern(a, rel, b))
+        elif direction is INCOMING:
+            self._hops.append(RelPattern(b, rel, a))
+        else:
+            raise ValueError, "Unknown direction: %s" % direction
+        self._plan = None
+        return self
+        
+        
+    def limit(self, n):
+        self._limit = n
+        return self
+        
+        
+    def explain(self):
+        """Describe the chosen plan, one step per line"""
+        plan = self.plan()
+        lines = [s.describe(self._nodes) for s in plan]
+        if self._limit is not None:
+            lines.append('limit %d' % self._limit)
+        lines.append('est. cost %d' % self._cost)
+        return '\n'.join(lines)
+        
+        
+    def plan(self):
+        if self._plan is None:
+            if not self._nodes:
+                raise ValueError, "Query has no node patterns"
+            self._estimates = {}
+            best = None
+            for name in self._order:
+                steps, cost = self._plan_from(name)
+                if best is None or cost < best[1]:
+                    best = (steps, cost)
+            self._plan, self._cost = best
+        return self._plan
+        
+        
+    def ids(self):
+        """Iterate matches as dicts of pattern name to node id"""
+        plan = self.plan()
+        self._index_ids = {}
+        n = 0
+        for binding in self._run(plan, 0, {}):
+            yield dict(binding)
+            n += 1
+            if self._limit is not None and n >= self._limit:
+                return
+                
+                
+    def __iter__(self):
+        for binding in self.ids():
+            yield dict([(k, self._graph[v]) for k, v in binding.items()])
+            
+            
+    def _plan_from(self, start):
+        bound = set([start])
+        rows = self._cardinality(start)
+        steps = [Step('scan', start, rows=rows)]
+        cost = rows
+        hops = list(self._hops)
+        while True:
+            checks = [h for h in hops if h.left in bound and h.right in bound]
+            for h in checks:
+                hops.remove(h)
+                steps.append(Step('check', h.left, hop=h, rows=rows))
+                cost += rows
+            if len(bound) == len(self._nodes):
+                break
+            best = None
+            for h in hops:
+                if h.left in bound:
+                    option = (self._fanout(h.left, h.rel, OUTGOING),
+                        Step('expand', h.right, hop=h, direction=OUTGOING))
+                elif h.right in bound:
+                    option = (self._fanout(h.right, h.rel, INCOMING),
+                        Step('expand', h.left, hop=h, direction=INCOMING))
+                else:
+                    continue
+                if best is None or option[0] < best[0]:
+                    best = option
+            for name in self._order:
+                p = self._nodes[name]
+                if name in bound or (best is not None and not p.has_source()):
+                    continue
+                option = (self._cardinality(name), Step('scan', name))
+                if best is None or option[0] < best[0]:
+                    best = option
+            multiplier, step = best
+            if step.kind == 'expand':
+                hops.remove(step.hop)
+                if self._nodes[step.var].has_source():
+                    multiplier = min(multiplier, self._cardinality(step.var))
+            rows = rows * multiplier
+            step.rows = int(rows)
+            steps.append(step)
+            cost += rows
+            bound.add(step.var)
+        return steps, cost
+        
+        
+    def _cardinality(self, name):
+        k = ('card', name)
+        if k not in self._estimates:
+            p = self._nodes[name]
+            if p.id is not None:
+                n = 1
+            elif p.index is not None:
+                n = self._graph.get_index(p.index).count(p.key)
+            else:
+                n = len(self._graph)
+            self._estimates[k] = n
+        return self._estimates[k]
+        
+        
+    def _fanout(self, name, rel, direction):
+        k = ('fanout', name, rel, direction)
+        if k not in self._estimates:
+            p = self._nodes[name]
+            if p.has_source() and self._cardinality(name) <= PROBE_CANDIDATES:
+                candidates = self._candidates(name)
+                total = sum([self._graph.degree(
+                    id, rel, direction, DEGREE_PROBE_LIMIT) for id in candidates])
+                f = float(total) / max(1, len(candidates))
+            else:
+                stats = self._graph.stats()
+                f = float(stats['num_edges']) / max(1, stats['num_nodes'])
+            self._estimates[k] = f
+        return self._estimates[k]
+        
+        
+    def _candidates(self, name):
+        p = self._nodes[name]
+        if p.id is not None:
+            return [p.id]
+        return self._graph.get_index(p.index).ids(p.key)
+        
+        
+    def _accept(self, name, node_id):
+        p = self._nodes[name]
+        if p.id is not None and node_id != p.id:
+            return False
+        if p.index is not None:
+            if name not in self._index_ids:
+                self._index_ids[name] = set(self._candidates(name))
+            if node_id not in self._index_ids[name]:
+                return False
+        if p.where is not None:
+            try:
+                node = self._graph[node_id]
+            except KeyError:
+                return False
+            if callable(p.where):
+                return bool(p.where(node))
+            for k, v in p.where.items():
+                if k not in node or node[k] != v:
+                    return False
+        return True
+        
+        
+    def _scan(self, name):
+        p = self._nodes[name]
+        if p.id is not None:
+            if p.id in self._graph:
+                yield p.id
+        elif p.index is not None:
+            for node_id in self._candidates(name):
+                if node_id in self._graph:
+                    yield node_id
+        else:
+            for node_id in self._graph.node_ids():
+                yield node_id
+                    
+                    
+    def _run(self, plan, i, binding):
+        if i == len(plan):
+            yield binding
+            return
+        step = plan[i]
+        if step.kind == 'check':
+            h = step.hop
+            if self._connected(binding[h.left], h.rel, binding[h.right]):
+                for b in self._run(plan, i+1, binding):
+                    yield b
+            return
+        if step.kind == 'scan':
+            candidates = self._scan(step.var)
+        else:
+            source = step.hop.other(step.var)
+            candidates = self._graph.neighbor_ids(
+                binding[source], step.hop.rel, step.direction)
+        for node_id in candidates:
+            if not self._accept(step.var, node_id):
+                continue
+            binding[step.var] = node_id
+            for b in self._run(plan, i+1, binding):
+                yield b
+            del binding[step.var]
+            
+            
+    def _connected(self, left_id, rel, right_id):
+        if rel is not None:
+            return self._graph.has_edge(left_id, rel, right_id)
+        return right_id in self._graph.neighbor_ids(left_id, None, OUTGOING)
@@ -0,0 +1,444 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Serve a graph's storage to other processes
+
+A GraphServer owns a storage group and serves storage operations, node id
+allocation and a few server-side traversals over a Unix or TCP socket. Many
+processes can share one graph through it with client.RemoteGraph, which
+offers the usual Graph API.
+
+    python -m groof.server [--backend tc|sqlite] PATH unix:/tmp/groof.sock
+    python -m groof.server PATH tcp:127.0.0.1:7474
+
+Every frame starts with a header of payload length, request id and an op
+code (requests) or status (responses), followed by the arguments as a count
+and length-prefixed strings. Each connection is served by its own thread and
+handles requests in order, so clients may pipeline requests and match the
+responses by request id. A connection that starts a transaction holds the
+graph's write lock until it commits or aborts.
+"""
+
+import os
+import socket
+import struct
+import sys
+import SocketServer
+from keys import META_KEY, pack_meta, unpack_meta
+from traverse import k_hop, shortest_path
+
+
+HEADER_FORMAT = '>IIB'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Length of a None argument
+NULL = 0xFFFFFFFF
+
+# Ops
+GET = 1
+SET = 2
+DELETE = 3
+CONTAINS = 4
+LENGTH = 5
+GETDUP = 6
+SETDUP = 7
+DELDUP = 8
+PREFIX = 9
+RANGE = 10
+RECORDS = 11
+BEGIN = 12
+COMMIT = 13
+ABORT = 14
+INDEX_NAMES = 15
+ALLOCATE = 16
+NEIGHBORS = 17
+K_HOP = 18
+SHORTEST_PATH = 19
+FLUSH = 20
+
+# Statuses
+OK = 0
+KEY_ERROR = 1
+ERROR = 2
+BAD_REQUEST = 3
+
+
+class ProtocolError(Exception):
+    pass
+    
+    
+    
+def pack_args(args):
+    parts = [struct.pack('>H', len(args))]
+    for a in args:
+        if a is None:
+            parts.append(struct.pack('>I', NULL))
+        else:
+            parts.append(struct.pack('>I', len(a)))
+            parts.append(a)
+    return ''.join(parts)
+    
+    
+def unpack_args(s):
+    n, = struct.unpack_from('>H', s)
+    i = 2
+    args = []
+    for j in xrange(n):
+        size, = struct.unpack_from('>I', s, i)
+        i += 4
+        if size == NULL:
+            args.append(None)
+        else:
+            args.append(s[i:i+size])
+            i += size
+    return args
+    
+    
+def pack_frame(request_id, code, args):
+    payload = pack_args(args)
+    return struct.pack(HEADER_FORMAT, len(payload), request_id, code) + payload
+    
+    
+def read_frame(f):
+    """Read a frame from a file-like object. Returns (request id, op or status,
+    args), or None at the end of the stream."""
+    header = f.read(HEADER_SIZE)
+    if not header:
+        return None
+    if len(header) < HEADER_SIZE:
+        raise ProtocolError, "Truncated frame header"
+    size, request_id, code = struct.unpack(HEADER_FORMAT, header)
+    payload = f.read(size)
+    if len(payload) < size:
+        raise ProtocolError, "Truncated frame"
+    return request_id, code, unpack_args(payload)
+    
+    
+def pack_int(i):
+    return struct.pack('>q', i)
+    
+    
+def unpack_int(s):
+    return struct.unpack('>q', s)[0]
+    
+    
+def pack_optional_int(i):
+    return None if i is None else pack_int(i)
+    
+    
+def unpack_optional_int(s):
+    return None if s is None else unpack_int(s)
+    
+    
+def pack_ids(ids):
+    return struct.pack('>%dQ' % len(ids), *ids)
+    
+    
+def unpack_ids(s):
+    return list(struct.unpack('>%dQ' % (len(s) / 8), s))
+    
+    
+def parse_address(address):
+    """Parse 'unix:PATH' or 'tcp:HOST:PORT' into (family, address)"""
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[5:]
+    elif address.startswith('tcp:'):
+        host, port = address[4:].rsplit(':', 1)
+        return socket.AF_INET, (host, int(port))
+    raise ValueError, "Expected unix:PATH or tcp:HOST:PORT, got %s" % address
+
+
+
+class GraphRequestHandler(SocketServer.StreamRequestHandler):
+
+    def setup(self):
+        if self.server.address_family == socket.AF_INET:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        SocketServer.StreamRequestHandler.setup(self)
+        self.graph = self.server.graph
+        self.in_txn = False
+        self.tombstones_written = False
+        self.ops = {
+            GET: self.op_get, SET: self.op_set, DELETE: self.op_delete,
+            CONTAINS: self.op_contains, LENGTH: self.op_length,
+            GETDUP: self.op_getdup, SETDUP: self.op_setdup, DELDUP: self.op_deldup,
+            PREFIX: self.op_prefix, RANGE: self.op_range, RECORDS: self.op_records,
+            BEGIN: self.op_begin, COMMIT: self.op_commit, ABORT: self.op_abort,
+            INDEX_NAMES: self.op_index_names, ALLOCATE: self.op_allocate,
+            NEIGHBORS: self.op_neighbors, K_HOP: self.op_k_hop,
+            SHORTEST_PATH: self.op_shortest_path, FLUSH: self.op_flush
+        }
+        
+        
+    def handle(self):
+        while True:
+            try:
+                frame = read_frame(self.rfile)
+            except (ProtocolError, socket.error):
+                return
+            if frame is None:
+                return
+            request_id, op, args = frame
+            if op not in self.ops:
+                status, values = BAD_REQUEST, ['Unknown op %d' % op]
+            else:
+                status, values = self.call(op, args)
+            self.wfile.write(pack_frame(request_id, status, values))
+            self.wfile.flush()
+            
+            
+    def call(self, op, args):
+        try:
+            return OK, self.ops[op](*args)
+        except KeyError, e:
+            return KEY_ERROR, [str(e.args[0]) if e.args else '']
+        except Exception, e:
+            return ERROR, ['%s: %s' % (e.__class__.__name__, e)]
+            
+            
+    def finish(self):
+        if self.in_txn:
+            self.op_abort()
+        SocketServer.StreamRequestHandler.finish(self)
+        
+        
+    def store(self, name):
+        if name.startswith('index:'):
+            return self.graph.storage.get_index(name[6:])
+        if name not in self.graph.storage.storage_attrs:
+            raise ValueError, "Unknown store: %s" % name
+        return getattr(self.graph.storage, name)
+        
+        
+    def write(self, name, method, *args):
+        """Apply a write, holding the write lock unless a transaction already
+        does"""
+        f = getattr(self.store(name), method)
+        if name == 'tombstones':
+            self.tombstones_written = True
+        if self.in_txn:
+            return f(*args)
+        self.graph._write_lock.acquire()
+        try:
+            return f(*args)
+        finally:
+            self.written()
+            self.graph._write_lock.release()
+            
+            
+    def written(self):
+        """Let the graph see nodes deleted by the client"""
+        if self.tombstones_written:
+            self.tombstones_written = False
+            self.graph.load_tombstones()
+            
+            
+    def op_get(self, name, k):
+        return [self.store(name)[k]]
+        
+        
+    def op_set(self, name, k, v):
+        self.write(name, '__setitem__', k, v)
+        return []
+        
+        
+    def op_delete(self, name, k):
+        self.write(name, '__delitem__', k)
+        return []
+        
+        
+    def op_contains(self, name, k):
+        return ['\x01' if k in self.store(name) else '']
+        
+        
+    def op_length(self, name):
+        return [pack_int(len(self.store(name)))]
+        
+        
+    def op_getdup(self, name, k):
+        return self.store(name).getdup(k)
+        
+        
+    def op_setdup(self, name, k, v):
+        self.write(name, 'setdup', k, v)
+        return []
+        
+        
+    def op_deldup(self, name, k):
+        self.write(name, 'deldup', k)
+        return []
+        
+        
+    def op_prefix(self, name, prefix, limit):
+        return self.store(name).match_prefix(prefix, unpack_int(limit))
+        
+        
+    def op_range(self, name, start, stop, limit):
+        return self.store(name).range(start, stop, unpack_int(limit))
+        
+        
+    def op_records(self, name, start, limit):
+        """Get key, value pairs for up to limit keys from start, including
+        every value of duplicate keys"""
+        store = self.store(name)
+        values = []
+        last = None
+        for k in store.range(start, None, unpack_int(limit)):
+            if k == last:
+                continue
+            last = k
+            for v in store.getdup(k):
+                values.extend((k, v))
+        return values
+        
+        
+    def op_begin(self):
+        if self.in_txn:
+            raise RuntimeError, "Transaction already started"
+        self.graph._write_lock.acquire()
+        try:
+            self.graph.storage.start_txn()
+        except:
+            self.graph._write_lock.release()
+            raise
+        self.in_txn = True
+        return []
+        
+        
+    def op_commit(self):
+        self._end_txn(self.graph.storage.commit_txn)
+        return []
+        
+        
+    def op_abort(self):
+        self._end_txn(self.graph.storage.abort_txn)
+        return []
+        
+        
+    def _end_txn(self, f):
+        if not self.in_txn:
+            raise RuntimeError, "No transaction started"
+        self.in_txn = False
+        try:
+            f()
+        finally:
+            self.written()
+            self.graph._write_lock.release()
+            
+            
+    def op_index_names(self):
+        return self.graph.storage.index_names()
+        
+        
+    def op_allocate(self, n):
+        """Reserve n node ids and return the first"""
+        return [pack_int(self.server.allocate(unpack_int(n)))]
+        
+        
+    def op_neighbors(self, node_id, rel, direction, limit):
+        return [pack_ids(self.graph.neighbor_ids(unpack_int(node_id),
+            unpack_optional_int(rel), unpack_int(direction), unpack_int(limit)))]
+            
+            
+    def op_k_hop(self, node_id, k, rel, direction):
+        ids = k_hop(self.graph[unpack_int(node_id)], unpack_int(k),
+            unpack_optional_int(rel), unpack_int(direction))
+        return [ids.dumps()]
+        
+        
+    def op_shortest_path(self, a, b, rel, max_depth):
+        path = shortest_path(self.graph[unpack_int(a)], self.graph[unpack_int(b)],
+            unpack_optional_int(rel), unpack_optional_int(max_depth))
+        return [] if path is None else [pack_ids(path)]
+        
+        
+    def op_flush(self):
+        self.graph.storage.flush()
+        return []
+
+
+
+class GraphServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """Serve graph at address, 'unix:PATH' or 'tcp:HOST:PORT'"""
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, graph, address):
+        self.graph = graph
+        self.address_family, address = parse_address(address)
+        if self.address_family == socket.AF_UNIX and os.path.exists(address):
+            os.unlink(address)
+        SocketServer.TCPServer.__init__(self, address, GraphRequestHandler)
+        
+        
+    def server_bind(self):
+        if self.address_family == socket.AF_UNIX:
+            self.socket.bind(self.server_address)
+            self.server_address = self.socket.getsockname()
+        else:
+            SocketServer.TCPServer.server_bind(self)
+            
+            
+    def allocate(self, n):
+        """Reserve n node ids, recording them in the meta record so they are
+        never handed out again. Returns the first id."""
+        g = self.graph
+        g._write_lock.acquire()
+        try:
+            version, last_id = unpack_meta(g.storage.node[META_KEY])
+            g.storage.node[META_KEY] = pack_meta(last_id + n)
+            g.last_node_id = g.next_node_id = last_id + n
+            return last_id + 1
+        finally:
+            g._write_lock.release()
+            
+            
+    def server_close(self):
+        SocketServer.TCPServer.server_close(self)
+        if self.address_family == socket.AF_UNIX and os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+            
+            
+            
+def serve(path, address, backend='tc'):
+    from groof import graph
+    server = GraphServer(graph(path, backend), address)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.graph.close()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    backend = 'tc'
+    if args[:1] == ['--backend']:
+        backend = args[1]
+        args = args[2:]
+    if len(args) != 2:
+        print >>sys.stderr, "usage: python -m groof.server [--backend tc|sqlite] PATH ADDRESS"
+        sys.exit(2)
+    try:
+        serve(args[0], args[1], backend)
+    except KeyboardInterrupt:
+        pass
\ No newline at end of file
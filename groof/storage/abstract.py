@@ -94,11 +94,23 @@ class IDuplicateKeyStorage(object):
 class IPrefixMatchingStorage(object):
     """Storage supporting key prefix matching"""
     
-    def match_prefix(self, prefix):
-        """Get keys matching the given prefix"""
+    def match_prefix(self, prefix, limit=-1):
+        """Get keys matching the given prefix, at most limit keys if limit is
+        not negative"""
         
         
         
+class IRangeStorage(object):
+    """Storage supporting ordered key range scans"""
+    
+    def range(self, start, stop=None, limit=-1):
+        """Get keys k with start <= k < stop in key order. If stop is None the
+        scan runs to the last key. At most limit keys are returned if limit is
+        not negative."""
+        raise NotImplementedError
+
+
+
 class IIterableStorage(object):
     """Storage supporting iteration of records"""
     
@@ -128,9 +140,11 @@ class IFileStorage(IStorage):
     
     
 class IStorageGroup(object):
-    """Provide storage instance attributes node, left, right and indices"""
+    """Provide storage instance attributes node, left, right, adjacency,
+    tombstones, blobs, journal and indices"""
     
-    storage_attrs = ['node', 'left', 'right']
+    storage_attrs = ['node', 'left', 'right', 'adjacency', 'tombstones', 'blobs',
+        'journal']
     
     
     def get_index(self, name):
@@ -143,11 +157,26 @@ class IStorageGroup(object):
         raise NotImplementedError
         
         
+    def index_names(self):
+        """Get the names of all existing indices"""
+        raise NotImplementedError
+        
+        
     def flush(self):
         """Flush writes to disk"""
         raise NotImplementedError
         
         
+    def open(self):
+        """Open storage again after close()"""
+        raise NotImplementedError
+        
+        
+    def close(self):
+        """Close all storage, including indices"""
+        raise NotImplementedError
+
+
 class TransactionalStorageGroup(IStorageGroup, ITransactionalStorage):
     
     
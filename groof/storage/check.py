@@ -0,0 +1,274 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Conformance checks and a micro benchmark shared by the storage backends.
+
+    python -m groof.storage.check [--bench N] [BACKEND ...]
+
+runs the checks, and the benchmark when N is given, against each backend
+(all available ones by default) in a temporary directory.
+"""
+
+
+import os, os.path
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import random
+
+
+BACKENDS = {
+    'tc': ('groof.storage.tc', 'TokyoCabinetStorageGroup'),
+    'sqlite': ('groof.storage.sqlite', 'SQLiteStorageGroup')
+}
+
+
+def get_backend(name):
+    """Get the storage group class for a backend name. Raises ImportError if
+    the backend's library is not installed."""
+    module, cls = BACKENDS[name]
+    __import__(module)
+    return getattr(sys.modules[module], cls)
+    
+    
+def _raises_key_error(f, *args):
+    try:
+        f(*args)
+    except KeyError:
+        return True
+    return False
+    
+    
+def check_storage(s):
+    """Check the IStorage, IDuplicateKeyStorage, IPrefixMatchingStorage,
+    IRangeStorage and IIterableStorage behavior of an empty store"""
+    assert len(s) == 0
+    assert list(s) == []
+    assert _raises_key_error(s.__getitem__, 'a')
+    assert _raises_key_error(s.__delitem__, 'a')
+    
+    keys = ['a', 'ab', 'abc', 'b', '\x00', '\x00\xff', '\xff', '\xff\xff\x01']
+    for k in keys:
+        s[k] = 'v' + k
+    s['ab'] = 'v2'
+    assert len(s) == len(keys)
+    assert s['ab'] == 'v2' and s['\x00'] == 'v\x00'
+    assert 'abc' in s and 'ac' not in s
+    assert list(s) == sorted(keys), list(s)
+    assert list(s.iter_records())[0] == ('\x00', 'v\x00')
+    
+    assert s.match_prefix('a') == ['a', 'ab', 'abc']
+    assert s.match_prefix('a', 2) == ['a', 'ab']
+    assert s.match_prefix('\xff') == ['\xff', '\xff\xff\x01']
+    assert s.match_prefix('\x00') == ['\x00', '\x00\xff']
+    assert s.match_prefix('c') == []
+    assert s.range('a', 'b') == ['a', 'ab', 'abc']
+    assert s.range('aa', None, 2) == ['ab', 'abc']
+    assert s.range('b') == ['b', '\xff', '\xff\xff\x01']
+    assert s.range('a', 'b', 0) == []
+    
+    del s['ab']
+    assert 'ab' not in s and len(s) == len(keys) - 1
+    
+    s.setdup('d', '1')
+    s.setdup('d', '2')
+    s.setdup('d', '3')
+    assert s.getdup('d') == ['1', '2', '3']
+    assert s['d'] == '1'
+    assert [r for r in s.iter_records() if r[0] == 'd'] == \
+        [('d', '1'), ('d', '2'), ('d', '3')]
+    s.deldup('d')
+    assert 'd' not in s
+    assert _raises_key_error(s.getdup, 'd')
+    
+    
+def check_group(group):
+    """Check a new, empty storage group"""
+    for n in group.storage_attrs:
+        check_storage(getattr(group, n))
+    check_storage(group.get_index('check'))
+    assert 'check' in group.index_names()
+    
+    group.start_txn()
+    group.node['t'] = '1'
+    group.left['t'] = '1'
+    group.get_index('check')['t'] = '1'
+    group.commit_txn()
+    assert group.node['t'] == group.left['t'] == group.get_index('check')['t'] == '1'
+    
+    group.start_txn()
+    group.node['t'] = '2'
+    group.left['t'] = '2'
+    del group.get_index('check')['t']
+    group.abort_txn()
+    assert group.node['t'] == group.left['t'] == group.get_index('check')['t'] == '1'
+    
+    
+def check_backup(factory, path):
+    """Check that a graph dumped from a group of factory restores into a new
+    one, including an index with more duplicate records than a snapshot
+    reads per page"""
+    from groof.graph import Graph
+    from groof.mvcc import ITER_PAGE_SIZE
+    g = Graph(factory(os.path.join(path, 'dumped')))
+    with g:
+        nodes = [g.create_node(i=i) for i in xrange(10)]
+        nodes[0].edges.add(1, nodes[1])
+        index = g.get_index('dups')
+        for i in xrange(ITER_PAGE_SIZE * 2 / 3):
+            index.setmulti('k%05d' % i, nodes[i % 10])
+            index.setmulti('k%05d' % i, nodes[(i + 1) % 10])
+    g.dump(os.path.join(path, 'dump'))
+    h = Graph(factory(os.path.join(path, 'restored')))
+    h.restore(os.path.join(path, 'dump'))
+    for n in g.storage.storage_attrs:
+        if n != 'journal':
+            a, b = getattr(g.storage, n), getattr(h.storage, n)
+            assert list(a.iter_records()) == list(b.iter_records()), n
+    a, b = g.storage.get_index('dups'), h.storage.get_index('dups')
+    assert len(b) == len(a) == ITER_PAGE_SIZE * 2 / 3 * 2
+    assert list(a.iter_records()) == list(b.iter_records())
+    g.close()
+    h.close()
+    
+    
+def check_migrate(factory, path):
+    """Check that a format 0 graph written to a group of factory, with padded
+    native edge keys and an index, migrates to the current key format"""
+    import cjson
+    from groof.graph import Graph, INCOMING
+    from groof.keys import LEGACY_META_KEY
+    from groof.migrate import (
+        migrate, LEGACY_NODE_KEY_FORMAT, LEGACY_EDGE_KEY_FORMAT
+    )
+    path = os.path.join(path, 'legacy')
+    n = 300
+    old = factory(path)
+    index = old.get_index('parity')
+    old.start_txn()
+    old.node[LEGACY_META_KEY] = struct.pack(LEGACY_NODE_KEY_FORMAT, n)
+    for i in xrange(1, n + 1):
+        old.node[struct.pack(LEGACY_NODE_KEY_FORMAT, i)] = cjson.encode({'i': i})
+        index.setdup('even' if i % 2 == 0 else 'odd',
+            struct.pack(LEGACY_NODE_KEY_FORMAT, i))
+    for i in xrange(1, n):
+        old.left[struct.pack(LEGACY_EDGE_KEY_FORMAT, i, 7, i + 1)] = \
+            cjson.encode({'w': i})
+        old.right[struct.pack(LEGACY_EDGE_KEY_FORMAT, i + 1, 7, i)] = ''
+    old.commit_txn()
+    old.close()
+    assert migrate(path, factory) == 0
+    assert os.path.exists(path + '.v0')
+    g = Graph(factory(path))
+    assert len(g) == n
+    assert g.node_ids() == range(1, n + 1)
+    assert g[256]['i'] == 256
+    assert g.neighbor_ids(256, 7) == [257]
+    assert g.neighbor_ids(256, 7, INCOMING) == [255]
+    assert g.get_edge(255, 7, 256)['w'] == 255
+    assert sorted([node.id for node in g.get_index('parity').getmulti('even')]) == \
+        range(2, n + 1, 2)
+    with g:
+        assert g.create_node().id == n + 1
+    g.close()
+    assert migrate(path, factory) == 1
+    
+    
+def benchmark(group, n=10000, out=sys.stdout):
+    """Time basic operations on n records and print operations per second"""
+    keys = ['%016x' % random.getrandbits(64) for i in xrange(n)]
+    results = []
+    
+    def timed(name, f):
+        started = time.time()
+        f()
+        elapsed = max(time.time() - started, 1e-9)
+        results.append((name, n / elapsed))
+        print >>out, '  %-20s %10.0f ops/s' % (name, n / elapsed)
+        
+    def write():
+        group.start_txn()
+        for k in keys:
+            group.left[k] = 'x' * 32
+        group.commit_txn()
+        
+    def read():
+        for k in keys:
+            group.left[k]
+            
+    def prefix():
+        for k in keys:
+            group.left.match_prefix(k[:3], 10)
+            
+    def setdup():
+        index = group.get_index('bench')
+        group.start_txn()
+        for k in keys:
+            index.setdup(k[:2], k)
+        group.commit_txn()
+        
+    timed('write (one txn)', write)
+    timed('read', read)
+    timed('prefix scan', prefix)
+    timed('setdup (one txn)', setdup)
+    return results
+    
+    
+def main(argv):
+    bench = None
+    if argv[:1] == ['--bench']:
+        bench = int(argv[1])
+        argv = argv[2:]
+    names = argv or sorted(BACKENDS)
+    failed = False
+    for name in names:
+        try:
+            factory = get_backend(name)
+        except ImportError, e:
+            print '%s: skipped (%s)' % (name, e)
+            continue
+        tmp = tempfile.mkdtemp(prefix='groof-check-')
+        try:
+            group = factory(os.path.join(tmp, 'check'))
+            try:
+                check_group(group)
+                check_backup(factory, tmp)
+                check_migrate(factory, tmp)
+                print '%s: ok' % name
+            except AssertionError:
+                import traceback
+                traceback.print_exc()
+                print '%s: FAILED' % name
+                failed = True
+            group.close()
+            if bench:
+                group = factory(os.path.join(tmp, 'bench'))
+                benchmark(group, bench)
+                group.close()
+        finally:
+            shutil.rmtree(tmp)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
\ No newline at end of file
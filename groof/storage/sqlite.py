@@ -0,0 +1,337 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+File storage implementation backed by SQLite.
+
+All the stores of a group, indices included, are WITHOUT ROWID tables in a
+single database, so one transaction covers a whole Graph.save. The database
+runs in WAL mode and every thread gets its own connection, so readers run
+concurrently with each other and with a writer. SQL is built once per table
+and reused through the connection's statement cache. Requires SQLite 3.15
+or later.
+"""
+
+
+import os, os.path
+import sqlite3
+import threading
+from abstract import (
+    IFileStorage, IPrefixMatchingStorage, IDuplicateKeyStorage, IIterableStorage,
+    IRangeStorage, ITransactionalStorage, TransactionalStorageGroup
+)
+
+
+# Records are read this many at a time when iterating a table
+ITER_BATCH_SIZE = 1000
+
+# Seconds to wait for another connection's write lock
+BUSY_TIMEOUT = 30.0
+
+
+def _blob(s):
+    return sqlite3.Binary(s)
+    
+    
+def _prefix_end(prefix):
+    """Get the smallest key greater than every key starting with prefix, or
+    None if there isn't one"""
+    prefix = prefix.rstrip('\xff')
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+
+class Database(object):
+    """Per-thread connections to one SQLite database file"""
+    
+    def __init__(self, path, cache_size=None, mmap_size=None, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        
+        
+    def _get_connection(self):
+        c = getattr(self._local, 'connection', None)
+        if c is None:
+            c = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT,
+                isolation_level=None, check_same_thread=False,
+                cached_statements=256)
+            c.execute('PRAGMA journal_mode=WAL')
+            c.execute('PRAGMA synchronous=NORMAL')
+            if self.cache_size is not None:
+                # A negative cache size is in KiB rather than pages
+                c.execute('PRAGMA cache_size=%d' % -max(1, self.cache_size / 1024))
+            if self.mmap_size is not None:
+                c.execute('PRAGMA mmap_size=%d' % self.mmap_size)
+            if self.readonly:
+                c.execute('PRAGMA query_only=ON')
+            self._local.connection = c
+            self._local.depth = 0
+            self._lock.acquire()
+            try:
+                self._connections.append(c)
+            finally:
+                self._lock.release()
+        return c
+        
+    connection = property(_get_connection)
+    
+    
+    def execute(self, sql, args=()):
+        return self.connection.execute(sql, args)
+        
+        
+    def begin(self):
+        c = self.connection
+        if self._local.depth == 0:
+            c.execute('BEGIN IMMEDIATE')
+        self._local.depth += 1
+        
+        
+    def commit(self):
+        c = self.connection
+        if self._local.depth == 0:
+            return
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            c.execute('COMMIT')
+            
+            
+    def abort(self):
+        c = self.connection
+        if self._local.depth > 0:
+            self._local.depth = 0
+            c.execute('ROLLBACK')
+            
+            
+    def checkpoint(self):
+        self.execute('PRAGMA wal_checkpoint')
+        
+        
+    def close(self):
+        self._lock.acquire()
+        try:
+            [c.close() for c in self._connections]
+            self._connections = []
+            self._local = threading.local()
+        finally:
+            self._lock.release()
+
+
+
+class SQLiteStorage(IFileStorage, IPrefixMatchingStorage, IDuplicateKeyStorage,
+    IIterableStorage, IRangeStorage, ITransactionalStorage):
+    """A table of (key, duplicate number, value) records"""
+    
+    def __init__(self, db, table):
+        self._db = db
+        self.table = table
+        t = '"%s"' % table.replace('"', '""')
+        db.execute('CREATE TABLE IF NOT EXISTS %s '
+            '(k BLOB NOT NULL, i INTEGER NOT NULL, v BLOB NOT NULL, '
+            'PRIMARY KEY (k, i)) WITHOUT ROWID' % t)
+        self._sql = dict(
+            get = 'SELECT v FROM %s WHERE k = ? ORDER BY i LIMIT 1' % t,
+            getdup = 'SELECT v FROM %s WHERE k = ? ORDER BY i' % t,
+            contains = 'SELECT 1 FROM %s WHERE k = ? LIMIT 1' % t,
+            set = 'INSERT OR REPLACE INTO %s (k, i, v) VALUES (?, '
+                'COALESCE((SELECT MIN(i) FROM %s WHERE k = ?), 0), ?)' % (t, t),
+            setdup = 'INSERT INTO %s (k, i, v) VALUES (?, '
+                'COALESCE((SELECT MAX(i) + 1 FROM %s WHERE k = ?), 0), ?)' % (t, t),
+            delete = 'DELETE FROM %s WHERE k = ? AND '
+                'i = (SELECT MIN(i) FROM %s WHERE k = ?)' % (t, t),
+            deldup = 'DELETE FROM %s WHERE k = ?' % t,
+            count = 'SELECT COUNT(*) FROM %s' % t,
+            range = 'SELECT k FROM %s WHERE k >= ? ORDER BY k, i LIMIT ?' % t,
+            range_stop = 'SELECT k FROM %s WHERE k >= ? AND k < ? '
+                'ORDER BY k, i LIMIT ?' % t,
+            prefix = 'SELECT DISTINCT k FROM %s WHERE k >= ? ORDER BY k LIMIT ?' % t,
+            prefix_stop = 'SELECT DISTINCT k FROM %s WHERE k >= ? AND k < ? '
+                'ORDER BY k LIMIT ?' % t,
+            records = 'SELECT k, i, v FROM %s WHERE (k, i) > (?, ?) '
+                'ORDER BY k, i LIMIT ?' % t,
+            first_records = 'SELECT k, i, v FROM %s ORDER BY k, i LIMIT ?' % t,
+            clear = 'DELETE FROM %s' % t
+        )
+        
+        
+    def __setitem__(self, k, v):
+        self._db.execute(self._sql['set'], (_blob(k), _blob(k), _blob(v)))
+        
+        
+    def __getitem__(self, k):
+        row = self._db.execute(self._sql['get'], (_blob(k),)).fetchone()
+        if row is None:
+            raise KeyError, k
+        return str(row[0])
+        
+        
+    def __delitem__(self, k):
+        if self._db.execute(self._sql['delete'], (_blob(k), _blob(k))).rowcount == 0:
+            raise KeyError, k
+            
+            
+    def __contains__(self, k):
+        return self._db.execute(self._sql['contains'], (_blob(k),)).fetchone() is not None
+        
+        
+    def __len__(self):
+        return self._db.execute(self._sql['count']).fetchone()[0]
+        
+        
+    def setdup(self, k, v):
+        self._db.execute(self._sql['setdup'], (_blob(k), _blob(k), _blob(v)))
+        
+        
+    def getdup(self, k):
+        values = [str(r[0]) for r in self._db.execute(self._sql['getdup'], (_blob(k),))]
+        if not values:
+            raise KeyError, k
+        return values
+        
+        
+    def deldup(self, k):
+        if self._db.execute(self._sql['deldup'], (_blob(k),)).rowcount == 0:
+            raise KeyError, k
+            
+            
+    def clear(self):
+        self._db.execute(self._sql['clear'])
+        
+        
+    def open(self, path, mode):
+        pass
+        
+        
+    def close(self):
+        pass
+        
+        
+    def flush(self):
+        self._db.checkpoint()
+        
+        
+    def match_prefix(self, prefix, limit=-1):
+        end = _prefix_end(prefix)
+        if end is None:
+            rows = self._db.execute(self._sql['prefix'], (_blob(prefix), limit))
+        else:
+            rows = self._db.execute(self._sql['prefix_stop'],
+                (_blob(prefix), _blob(end), limit))
+        return [str(r[0]) for r in rows]
+        
+        
+    def range(self, start, stop=None, limit=-1):
+        if stop is None:
+            rows = self._db.execute(self._sql['range'], (_blob(start), limit))
+        else:
+            rows = self._db.execute(self._sql['range_stop'],
+                (_blob(start), _blob(stop), limit))
+        return [str(r[0]) for r in rows]
+        
+        
+    def __iter__(self):
+        for k, v in self.iter_records():
+            yield k
+            
+            
+    def iter_records(self):
+        # Page through the table so writes made while iterating don't
+        # disturb an open cursor
+        rows = self._db.execute(self._sql['first_records'],
+            (ITER_BATCH_SIZE,)).fetchall()
+        while rows:
+            for k, i, v in rows:
+                yield str(k), str(v)
+            k, i, v = rows[-1]
+            rows = self._db.execute(self._sql['records'],
+                (k, i, ITER_BATCH_SIZE)).fetchall()
+                
+                
+    def start_txn(self):
+        self._db.begin()
+        
+        
+    def abort_txn(self):
+        self._db.abort()
+        
+        
+    def commit_txn(self):
+        self._db.commit()
+
+
+
+class SQLiteStorageGroup(TransactionalStorageGroup):
+    """Storage group in basedir/graph.db. cache_size and mmap_size cap the
+    page cache and mapped memory of each connection in bytes. A readonly
+    group refuses writes."""
+
+    def __init__(self, basedir, cache_size=None, mmap_size=None, readonly=False):
+        if not os.path.exists(basedir):
+            os.makedirs(basedir)
+            
+        self.db = Database(os.path.join(basedir, 'graph.db'), cache_size, mmap_size,
+            readonly)
+        for n in self.storage_attrs:
+            setattr(self, n, SQLiteStorage(self.db, n))
+        self.indices = {}
+        
+        
+    def get_index(self, name):
+        if name not in self.indices:
+            self.indices[name] = SQLiteStorage(self.db, 'index:' + name)
+        return self.indices[name]
+        
+        
+    def index_names(self):
+        rows = self.db.execute("SELECT name FROM sqlite_master "
+            "WHERE type = 'table' AND name LIKE 'index:%' ORDER BY name")
+        return [str(r[0])[len('index:'):] for r in rows]
+        
+        
+    def start_txn(self):
+        self.db.begin()
+        
+        
+    def abort_txn(self):
+        self.db.abort()
+        
+        
+    def commit_txn(self):
+        self.db.commit()
+        
+        
+    def flush(self):
+        self.db.checkpoint()
+        
+        
+    def open(self):
+        """Connections are opened on demand, so there is nothing to do"""
+        
+        
+    def close(self):
+        self.db.close()
+        self.indices = {}
\ No newline at end of file
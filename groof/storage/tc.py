@@ -27,10 +27,17 @@ import os, os.path
 from tokyocabinet import btree
 from abstract import (
     IFileStorage, IPrefixMatchingStorage, IDuplicateKeyStorage, IIterableStorage,
-    ITransactionalStorage, TransactionalStorageGroup
+    IRangeStorage, ITransactionalStorage, TransactionalStorageGroup
 )
 
 
+# Estimated size of a cached leaf page, used to size the page caches
+LEAF_PAGE_SIZE = 8192
+
+# Tokyo cabinet won't cache fewer pages than this
+MIN_CACHED_PAGES = 64
+
+
 class TokyoCabinetStorage(IFileStorage, IPrefixMatchingStorage, ITransactionalStorage):
     
     def __setitem__(self, k, v):
@@ -92,11 +99,18 @@ class TokyoCabinetStorage(IFileStorage, IPrefixMatchingStorage, ITransactionalSt
         
         
         
-class BTreeStorage(TokyoCabinetStorage, IDuplicateKeyStorage, IIterableStorage):
+class BTreeStorage(TokyoCabinetStorage, IDuplicateKeyStorage, IIterableStorage,
+    IRangeStorage):
     
-    def __init__(self):
+    def __init__(self, cache_size=None, mmap_size=None):
         self._db = btree.BTree()
         self._db.tune(0,0,0,0,0,btree.BDBTLARGE|btree.BDBTTCBS)
+        if cache_size is not None:
+            # Tokyo cabinet caches whole pages, so convert bytes to pages
+            lcnum = max(MIN_CACHED_PAGES, cache_size / LEAF_PAGE_SIZE)
+            self._db.setcache(lcnum, max(MIN_CACHED_PAGES, lcnum / 2))
+        if mmap_size is not None:
+            self._db.setxmsiz(mmap_size)
         
         
     def open(self, path, mode):
@@ -146,6 +160,27 @@ class BTreeStorage(TokyoCabinetStorage, IDuplicateKeyStorage, IIterableStorage):
             pass
             
             
+    def range(self, start, stop=None, limit=-1):
+        keys = []
+        if limit == 0 or len(self._db) == 0:
+            return keys
+            
+        c = self._db.cursor()
+        
+        try:
+            c.jump(start)
+            k = c.key()
+            while stop is None or k < stop:
+                keys.append(k)
+                if len(keys) == limit:
+                    break
+                c.next()
+                k = c.key()
+        except KeyError:
+            pass
+        return keys
+        
+        
     def iter_records(self):
         if len(self._db) == 0:
             return
@@ -165,28 +200,103 @@ class BTreeStorage(TokyoCabinetStorage, IDuplicateKeyStorage, IIterableStorage):
         
         
 class TokyoCabinetStorageGroup(TransactionalStorageGroup):
+    """Storage group of B-tree files in basedir. cache_size and mmap_size cap
+    the page cache and mapped memory of the whole group in bytes; they are
+    split between its files, indices opened later included (beyond Tokyo
+    Cabinet's minimum cache per file). A readonly group takes shared locks, so any
+    number of processes can read the files at once."""
     
-    def __init__(self, basedir):
+    def __init__(self, basedir, cache_size=None, mmap_size=None, readonly=False):
         if not os.path.exists(basedir):
             os.makedirs(basedir)
         
-        for n in self.storage_attrs:
-            i = BTreeStorage()
-            i.open(os.path.join(basedir, n), 'rw')
-            setattr(self, n, i)
-        
+        self.basedir = basedir
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.mode = 'r' if readonly else 'rw'
         self.index_dir = os.path.join(basedir, 'indices')
         
         if not os.path.exists(self.index_dir):
             os.makedirs(self.index_dir)
             
         self.indices = {}
+        self.in_txn = False
+        self.open()
+        
+        
+    def open(self):
+        """Open the files of the group again after close()"""
+        # The fixed stores and the indices that exist now each get an even
+        # share of the budget, and one share is kept back. Indices opened
+        # later each get half of what is left, so the total stays within the
+        # budget.
+        self._num_shares = len(self.storage_attrs) + len(self.index_names()) + 1
+        self._cache_left = self.cache_size
+        self._mmap_left = self.mmap_size
+        for n in self.storage_attrs:
+            setattr(self, n, self._open_storage(os.path.join(self.basedir, n)))
+        self.closed = False
+        
+        
+    def _open_storage(self, path):
+        cache_size = self._take_share(self.cache_size, '_cache_left')
+        mmap_size = self._take_share(self.mmap_size, '_mmap_left')
+        self._num_shares = max(0, self._num_shares - 1)
+        i = BTreeStorage(cache_size, mmap_size)
+        i.open(path, self.mode)
+        return i
+        
         
+    def _take_share(self, total, attr):
+        """Take the budget of the next file from the part of total not yet
+        given out, which is kept in attribute attr"""
+        if total is None:
+            return None
+        left = getattr(self, attr)
+        share = left / self._num_shares if self._num_shares > 0 else left / 2
+        setattr(self, attr, left - share)
+        return share
         
         
     def get_index(self, name):
         if name not in self.indices:
-            self.indices[name] = BTreeStorage()
-            self.indices[name].open(os.path.join(self.index_dir, name),'rw')
+            index = self._open_storage(os.path.join(self.index_dir, name))
+            # Transactions are per file, so an index opened during one must
+            # join it or its commit would fail
+            if self.in_txn:
+                index.start_txn()
+            self.indices[name] = index
         return self.indices[name]
-        
\ No newline at end of file
+        
+        
+    def start_txn(self):
+        TransactionalStorageGroup.start_txn(self)
+        self.in_txn = True
+        
+        
+    def abort_txn(self):
+        self.in_txn = False
+        TransactionalStorageGroup.abort_txn(self)
+        
+        
+    def commit_txn(self):
+        self.in_txn = False
+        TransactionalStorageGroup.commit_txn(self)
+        
+        
+    def index_names(self):
+        return sorted(os.listdir(self.index_dir))
+        
+        
+    def flush(self):
+        [getattr(self, n).flush() for n in self.storage_attrs]
+        [i.flush() for i in self.indices.values()]
+        
+        
+    def close(self):
+        if self.closed:
+            return
+        [getattr(self, n).close() for n in self.storage_attrs]
+        [i.close() for i in self.indices.values()]
+        self.indices = {}
+        self.closed = True
\ No newline at end of file
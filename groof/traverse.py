@@ -20,96 +20,308 @@
 
 
 
-"""Simple graph traversal
-
-TODO: Update for current graph api
-"""
+"""Simple graph traversal"""
 
+import os
+import struct
+import zlib
 from collections import deque
+from graph import OUTGOING, INCOMING, edge_rows
+from idset import IdSet, pack_id_deltas, unpack_id_deltas
 
 
 BFS = 1
 DFS = 2
 
 
+STATE_MAGIC = 'GRTS'
+STATE_VERSION = 1
+STATE_HEADER_FORMAT = '>4sBBBQQII'
+STATE_HEADER_SIZE = struct.calcsize(STATE_HEADER_FORMAT)
+
+
 
 class Traversal(object):
+    """The state of a traversal as seen by evaluators. Nodes and the last edge
+    are only loaded from storage when they are accessed."""
     
-    def __init__(self, last_node, node, last_edge, depth, traversed, returned):
-        self.last_node = last_node
-        self.node = node
-        self.last_edge = last_edge
-        self.depth = depth
-        self.traversed = traversed
-        self.returned = returned
-
+    def __init__(self, graph, node_id):
+        self._graph = graph
+        self.last_node_id = None
+        self.node_id = node_id
+        self.last_edge_key = None
+        self.depth = 0
+        self.traversed = 0
+        self.returned = 0
+        self._node = None
+        
+        
+    def _get_node(self):
+        if self._node is None or self._node.id != self.node_id:
+            self._node = self._graph[self.node_id]
+        return self._node
+    node = property(_get_node)
+    
+    
+    def _get_last_node(self):
+        if self.last_node_id is None:
+            return None
+        return self._graph[self.last_node_id]
+    last_node = property(_get_last_node)
+    
+    
+    def _get_last_edge(self):
+        if self.last_edge_key is None:
+            return None
+        return self._graph.get_edge(*self.last_edge_key)
+    last_edge = property(_get_last_edge)
 
+    
+    
 class Traverser(object):
+    """Walk the graph from start_node.
     
+    rel may be a single rel, a list of rels or None to follow edges of any
+    type. direction is OUTGOING, INCOMING or BOTH. Nodes deeper than max_depth
+    are not visited and at most max_fanout edges are read for each node.
+    prune is called with the traversal when a node is reached; if it returns
+    True the node's neighbors are never fetched.
+    """
     
-    def __init__(self, start_node, traversal_algorithm, rel=None):
+    def __init__(self, start_node, traversal_algorithm, rel=None,
+            direction=OUTGOING, max_depth=None, max_fanout=None, prune=None,
+            state=None):
         if traversal_algorithm == BFS:
-            self.edges = self.breadth_first(deque([(start_node, 0)]))
+            self.edges = self.breadth_first()
         elif traversal_algorithm == DFS:
-            self.edges = self.depth_first(start_node, 0)
+            self.edges = self.depth_first()
         else:
-            raise ValueError, "Unknown traversal algorithm: %s", self.traversal_algorithm
+            raise ValueError, "Unknown traversal algorithm: %s" % traversal_algorithm
             
-        self.rel = rel
-        self.traversal = Traversal(None, start_node, None, 0, 0, 0)
-        self.visited = []
+        self.algorithm = traversal_algorithm
+        self.graph = start_node._graph
+        if rel is None or isinstance(rel, (int, long)):
+            self.rels = [rel]
+        else:
+            self.rels = list(rel)
+        self.direction = direction
+        self.max_depth = max_depth
+        self.max_fanout = max_fanout
+        self.prune = prune
+        self.traversal = Traversal(self.graph, start_node.id)
+        if state is None:
+            self.started = False
+            self.frontier = deque()
+            self.visited = set()
+        else:
+            if state.algorithm != traversal_algorithm:
+                raise ValueError, "Traversal state is for a different algorithm"
+            self.started = state.started
+            self.frontier = deque([[n, d, o, None] for (n, d, o) in state.frontier])
+            self.visited = set(state.visited)
+            self.traversal.traversed = state.traversed
+            self.traversal.returned = state.returned
         
         
     def __iter__(self):
-        if self.should_stop(self.traversal):
-            return
-        if self.should_return(self.traversal):
-            self.traversal.returned += 1
+        for node_id in self.iter_ids():
             yield self.traversal.node
-        self.visited.append(self.traversal.node.id)
-        for a, depth in self.edges:
-            self.traversal.last_node = self.traversal.node
-            self.traversal.node = a.right
-            self.traversal.last_edge = a
-            self.traversal.depth = depth
-            self.traversal.traversed += 1
-            if self.should_stop(self.traversal):
-                break
-            if self.should_return(self.traversal):
-                self.traversal.returned += 1
-                yield self.traversal.node
-    
-    
-    def breadth_first(self, q):
+            
+            
+    def iter_ids(self):
+        """Iterate the ids of returned nodes without loading the nodes"""
+        if not self.started:
+            self.started = True
+            t = self.traversal
+            self.visited.add(t.node_id)
+            if self.should_stop(t):
+                return
+            if self.should_expand(t):
+                self.frontier.append([t.node_id, 0, 0, None])
+            if self.should_return(t):
+                t.returned += 1
+                yield t.node_id
+        for node_id in self.edges:
+            yield node_id
+            
+            
+    def idset(self):
+        """Run the traversal to the end and get the returned ids as an IdSet"""
+        return IdSet(self.iter_ids())
+        
+        
+    def iter_edges(self):
+        """Iterate the (left_id, rel, right_id) keys of the edges by which the
+        returned nodes were reached. The start node has no such edge and is
+        skipped."""
+        t = self.traversal
+        for node_id in self.iter_ids():
+            if t.last_edge_key is not None and t.node_id == node_id:
+                yield t.last_edge_key
+                
+                
+    def rows(self, rows='tuples'):
+        """Run the traversal to the end and get the edges from iter_edges as
+        rows, see graph.edge_rows"""
+        return edge_rows(self.iter_edges(), rows)
+            
+            
+    def checkpoint(self):
+        """Capture the frontier, visited ids and counters of this traversal.
+        The state can be passed back to a new traverser to resume, once the
+        node last returned has been consumed."""
+        return TraversalState(self.algorithm,
+            [(n, d, o) for (n, d, o, edges) in self.frontier], self.visited,
+            self.traversal.traversed, self.traversal.returned, self.started)
+            
+            
+    def breadth_first(self):
+        q = self.frontier
         while len(q) > 0:
-            node,depth = q.popleft()
-            depth += 1
-            for edge in node.edges(self.rel):
-                if edge.right_id not in self.visited:
-                    self.visited.append(edge.right_id)
-                    yield edge, depth
-                    q.append((edge.right, depth))
+            frame = q[0]
+            for node_id in self.advance(frame, q.append):
+                yield node_id
+            if self.frontier is not q:
+                return
+            q.popleft()
         
         
-    def depth_first(self, node, depth):
-        depth += 1
-        for edge in node.edges(self.rel):
-            if edge.right_id not in self.visited:
-                self.visited.append(edge.right_id)
-                yield edge, depth
-                for e in self.depth_first(edge.right, depth):
-                    yield e
+    def depth_first(self):
+        stack = self.frontier
+        while len(stack) > 0:
+            frame = stack[-1]
+            for node_id in self.advance(frame, stack.append, 1):
+                yield node_id
+            if self.frontier is not stack:
+                return
+            if stack[-1] is frame and frame[2] >= len(frame[3]):
+                stack.pop()
+                
+                
+    def advance(self, frame, push, n=-1):
+        """Visit the unvisited neighbors of the node in frame, adding the ones
+        to be expanded with push. Stops after n nodes have been visited. The
+        frame's offset always points past the last edge handled so the frontier
+        can be checkpointed at any yield."""
+        node_id, depth, offset, edges = frame
+        if edges is None:
+            edges = frame[3] = self.expand(node_id)
+        while frame[2] < len(edges):
+            edge_key, other_id = edges[frame[2]]
+            frame[2] += 1
+            if other_id in self.visited:
+                continue
+            self.visited.add(other_id)
+            stop, ret, expand = self.arrive(node_id, edge_key, other_id, depth+1)
+            if stop:
+                self.frontier = deque()
+                return
+            if expand:
+                push([other_id, depth+1, 0, None])
+            if ret:
+                yield other_id
+            n -= 1
+            if n == 0:
+                return
+                
+                
+    def expand(self, node_id):
+        """Get (edge key, neighbor id) pairs for node_id, reading at most
+        max_fanout edges"""
+        limit = -1 if self.max_fanout is None else self.max_fanout
+        edges = []
+        for rel in self.rels:
+            for k in self.graph.adjacent_edges(node_id, rel, self.direction, limit):
+                edges.append((k, k[2] if k[0] == node_id else k[0]))
+            if limit >= 0:
+                limit = self.max_fanout - len(edges)
+                if limit <= 0:
+                    break
+        return edges
+        
+        
+    def arrive(self, from_id, edge_key, node_id, depth):
+        t = self.traversal
+        t.last_node_id = from_id
+        t.node_id = node_id
+        t.last_edge_key = edge_key
+        t.depth = depth
+        t.traversed += 1
+        if self.should_stop(t):
+            return True, False, False
+        ret = self.should_return(t)
+        if ret:
+            t.returned += 1
+        return False, ret, self.should_expand(t)
+        
+        
+    def should_expand(self, t):
+        if self.max_depth is not None and t.depth >= self.max_depth:
+            return False
+        if self.prune is not None and self.prune(t):
+            return False
+        return True
     
     
     def should_stop(self, t):
         raise NotImplementedError
     
     
-    def should_return(self):
+    def should_return(self, t):
         raise NotImplementedError
+
+
+
+class TraversalState(object):
+    """A serializable snapshot of a traversal: the frontier as (node id, depth,
+    edge offset) triples, the set of visited node ids and the counters."""
+    
+    def __init__(self, algorithm, frontier, visited, traversed=0, returned=0,
+            started=True):
+        self.algorithm = algorithm
+        self.started = started
+        self.frontier = list(frontier)
+        self.visited = visited
+        self.traversed = traversed
+        self.returned = returned
         
         
+    def dumps(self):
+        """Encode as a compressed string. Visited ids are sorted and stored as
+        varint deltas."""
+        body = [struct.pack('>QII', n, d, o) for (n, d, o) in self.frontier]
+        body.append(pack_id_deltas(sorted(self.visited)))
+        return struct.pack(STATE_HEADER_FORMAT, STATE_MAGIC, STATE_VERSION,
+            self.algorithm, self.started, self.traversed, self.returned,
+            len(self.frontier), len(self.visited)) + zlib.compress(''.join(body))
+            
+            
+    def save(self, path):
+        """Write to path atomically, replacing any previous checkpoint"""
+        tmp = path + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            f.write(self.dumps())
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, path)
         
+        
+    def split(self, n):
+        """Divide the frontier of a breadth-first traversal into n states that
+        can be resumed by separate processes. Every part starts with the full
+        visited set, but parts do not see each other's progress, so nodes
+        reachable from several parts may be visited more than once."""
+        if self.algorithm != BFS:
+            raise ValueError, "Only breadth-first traversals can be split"
+        return [TraversalState(self.algorithm, self.frontier[i::n], self.visited,
+            self.traversed if i == 0 else 0, self.returned if i == 0 else 0)
+            for i in range(n)]
+    
+    
+    
 class TraverserGenerator(Traverser):
     
     def __init__(self, f, *args, **kwargs):
@@ -129,4 +341,113 @@ class TraverserGenerator(Traverser):
     
     
     def should_return(self, t):
-        return self._should_return
\ No newline at end of file
+        return self._should_return
+        
+        
+        
+def shortest_path(a, b, rel=None, max_depth=None):
+    """Find a shortest directed path from node a to node b following edges of
+    type rel (any type if rel is None). Returns the list of node ids on the
+    path including both ends, or None if there is no path within max_depth
+    edges.
+    
+    Runs a breadth-first search from both ends at once, always advancing the
+    smaller frontier. The forward search reads the left store and the backward
+    search reads the right store.
+    """
+    graph = a._graph
+    if a.id == b.id:
+        return [a.id]
+    parents = {a.id: None}
+    children = {b.id: None}
+    forward = [a.id]
+    backward = [b.id]
+    depth = 0
+    while forward and backward:
+        if max_depth is not None and depth >= max_depth:
+            return None
+        depth += 1
+        if len(forward) <= len(backward):
+            forward, meetings = _expand_level(
+                graph, forward, rel, OUTGOING, parents, children)
+        else:
+            backward, meetings = _expand_level(
+                graph, backward, rel, INCOMING, children, parents)
+        if meetings:
+            return min([_join_path(m, parents, children) for m in meetings], key=len)
+    return None
+    
+    
+def k_hop(node, k, rel=None, direction=OUTGOING):
+    """Get an IdSet of the nodes reachable from node in 1 to k hops. Only ids
+    are read, no Node or Edge objects are created."""
+    graph = node._graph
+    seen = set([node.id])
+    frontier = [node.id]
+    for i in range(k):
+        next_frontier = []
+        for node_id in frontier:
+            for other_id in graph.neighbor_ids(node_id, rel, direction):
+                if other_id not in seen:
+                    seen.add(other_id)
+                    next_frontier.append(other_id)
+        if not next_frontier:
+            break
+        frontier = next_frontier
+    seen.discard(node.id)
+    return IdSet(seen)
+    
+    
+def _expand_level(graph, frontier, rel, direction, seen, other_seen):
+    next_frontier = []
+    meetings = []
+    for node_id in frontier:
+        for other_id in graph.neighbor_ids(node_id, rel, direction):
+            if other_id in seen:
+                continue
+            seen[other_id] = node_id
+            next_frontier.append(other_id)
+            if other_id in other_seen:
+                meetings.append(other_id)
+    return next_frontier, meetings
+    
+    
+def _join_path(node_id, parents, children):
+    path = []
+    n = node_id
+    while n is not None:
+        path.append(n)
+        n = parents[n]
+    path.reverse()
+    n = children[node_id]
+    while n is not None:
+        path.append(n)
+        n = children[n]
+    return path
+    
+    
+def loads_state(s):
+    """Decode a TraversalState from a string made by TraversalState.dumps"""
+    (magic, version, algorithm, started, traversed, returned, num_frontier,
+        num_visited) = struct.unpack(STATE_HEADER_FORMAT, s[:STATE_HEADER_SIZE])
+    if magic != STATE_MAGIC:
+        raise ValueError, "Not a traversal state"
+    if version != STATE_VERSION:
+        raise ValueError, "Unsupported traversal state version: %s" % version
+    body = zlib.decompress(s[STATE_HEADER_SIZE:])
+    frontier = []
+    for i in range(num_frontier):
+        frontier.append(struct.unpack('>QII', body[i*16:i*16+16]))
+    visited = set(unpack_id_deltas(body[num_frontier*16:]))
+    if len(visited) != num_visited:
+        raise ValueError, "Corrupt traversal state"
+    return TraversalState(algorithm, frontier, visited, traversed, returned,
+        bool(started))
+    
+    
+def load_state(path):
+    f = open(path, 'rb')
+    try:
+        return loads_state(f.read())
+    finally:
+        f.close()
\ No newline at end of file
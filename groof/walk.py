@@ -0,0 +1,224 @@
+# Copyright (c) 2009 Elisha Cook <elisha@elishacook.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Random walks for embedding pipelines (DeepWalk, node2vec)
+
+A Walker steps over sorted neighbor id arrays kept in a NeighborCache, so a
+step never creates Node or Edge objects. With p and q other than 1 the walk
+is biased like node2vec: returning to the previous node is weighted 1/p,
+moving to a neighbor of the previous node 1 and moving further away 1/q.
+Biased steps use rejection sampling, so no per-edge tables are built.
+
+Each walk has its own random generator seeded from the walker's seed, the
+start node and the walk number, so the same walks come out however the
+start nodes are split into batches or processes.
+
+    w = Walker(g, length=40, p=0.5, q=2.0, rel=FOLLOWS, seed=7)
+    for walk in w.walks(g.node_ids(), walks_per_node=10):
+        ...
+    write_walks('/data/graph', '/data/walks', processes=8, length=40, seed=7)
+"""
+
+import os
+import random
+from bisect import bisect_left
+from collections import OrderedDict
+from keys import OUTGOING
+from idset import id_array
+
+
+# Neighbor arrays kept by default
+CACHE_SIZE = 100000
+
+
+
+class NeighborCache(object):
+    """Sorted arrays of the distinct neighbor ids of nodes, most recently used
+    max_nodes of them. rel may be a single rel, a list of rels or None."""
+    
+    def __init__(self, graph, rel=None, direction=OUTGOING, max_nodes=CACHE_SIZE):
+        self.graph = graph
+        if rel is None or isinstance(rel, (int, long)):
+            self.rels = [rel]
+        else:
+            self.rels = list(rel)
+        self.direction = direction
+        self.max_nodes = max_nodes
+        self.hits = 0
+        self.misses = 0
+        self._arrays = OrderedDict()
+        
+        
+    def __getitem__(self, node_id):
+        try:
+            ids = self._arrays.pop(node_id)
+            self.hits += 1
+        except KeyError:
+            ids = self._load(node_id)
+            self.misses += 1
+            if len(self._arrays) >= self.max_nodes:
+                self._arrays.popitem(False)
+        self._arrays[node_id] = ids
+        return ids
+        
+        
+    def _load(self, node_id):
+        ids = []
+        for rel in self.rels:
+            ids.extend(self.graph.neighbor_ids(node_id, rel, self.direction))
+        return id_array(sorted(set(ids)))
+        
+        
+        
+def walk_seed(seed, start_id, n):
+    """Seed of the random generator of walk n from start_id"""
+    return (seed * 0x9E3779B97F4A7C15 + start_id * 0x100000001B3 + n) & 0xFFFFFFFFFFFFFFFF
+
+
+
+class Walker(object):
+
+    def __init__(self, graph, length=80, p=1.0, q=1.0, rel=None,
+            direction=OUTGOING, seed=0, cache=None):
+        if p <= 0 or q <= 0:
+            raise ValueError, "p and q must be positive"
+        self.graph = graph
+        self.length = length
+        self.seed = seed
+        self.neighbors = cache or NeighborCache(graph, rel, direction)
+        self.biased = p != 1.0 or q != 1.0
+        # Acceptance weights scaled so the largest is 1
+        top = max(1.0 / p, 1.0, 1.0 / q)
+        self.return_weight = 1.0 / p / top
+        self.near_weight = 1.0 / top
+        self.far_weight = 1.0 / q / top
+        
+        
+    def walk(self, start_id, n=0):
+        """Get walk number n from start_id as a list of at most length ids"""
+        rng = random.Random(walk_seed(self.seed, start_id, n))
+        rand = rng.random
+        neighbors = self.neighbors
+        walk = [start_id]
+        prev_id = None
+        node_id = start_id
+        while len(walk) < self.length:
+            ids = neighbors[node_id]
+            if not ids:
+                break
+            if prev_id is None or not self.biased:
+                next_id = ids[int(rand() * len(ids))]
+            else:
+                prev_ids = neighbors[prev_id]
+                while True:
+                    next_id = ids[int(rand() * len(ids))]
+                    if next_id == prev_id:
+                        w = self.return_weight
+                    elif _has(prev_ids, next_id):
+                        w = self.near_weight
+                    else:
+                        w = self.far_weight
+                    if rand() < w:
+                        break
+            walk.append(next_id)
+            prev_id, node_id = node_id, next_id
+        return walk
+        
+        
+    def walks(self, start_ids, walks_per_node=1):
+        """Generate walks_per_node walks from each start id, in rounds so the
+        walks from one node are spread out"""
+        start_ids = list(start_ids)
+        for n in xrange(walks_per_node):
+            for start_id in start_ids:
+                yield self.walk(start_id, n)
+                
+                
+    def batches(self, start_ids, walks_per_node=1, batch_size=1000):
+        """Generate lists of at most batch_size walks"""
+        batch = []
+        for walk in self.walks(start_ids, walks_per_node):
+            batch.append(walk)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+            
+            
+            
+def _has(ids, id):
+    i = bisect_left(ids, id)
+    return i < len(ids) and ids[i] == id
+    
+    
+def write(walks, f):
+    """Write walks to a file, one walk per line as space separated ids"""
+    for walk in walks:
+        f.write(' '.join(map(str, walk)))
+        f.write('\n')
+        
+        
+def _write_part(args):
+    path, backend, start_ids, out_path, walks_per_node, options = args
+    from groof import graph
+    g = graph(path, backend, readonly=True)
+    try:
+        walker = Walker(g, **options)
+        f = open(out_path + '.tmp', 'w')
+        try:
+            for batch in walker.batches(start_ids, walks_per_node):
+                write(batch, f)
+        finally:
+            f.close()
+        os.rename(out_path + '.tmp', out_path)
+    finally:
+        g.close()
+    return out_path
+    
+    
+def write_walks(path, out_prefix, start_ids=None, walks_per_node=1,
+        processes=1, backend='tc', **options):
+    """Write walks over the graph at path to out_prefix.0, out_prefix.1, ...,
+    one file per process. Start ids default to every node. Other keyword
+    arguments are passed to Walker. Returns the file names.
+    
+    Every process opens the graph read-only, which Tokyo Cabinet refuses
+    while another process has it open for writing."""
+    if start_ids is None:
+        from groof import graph
+        g = graph(path, backend, readonly=True)
+        try:
+            start_ids = g.node_ids()
+        finally:
+            g.close()
+    start_ids = list(start_ids)
+    parts = [(path, backend, start_ids[i::processes], '%s.%d' % (out_prefix, i),
+        walks_per_node, options) for i in range(processes)]
+    if processes == 1:
+        return [_write_part(parts[0])]
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_write_part, parts)
+    finally:
+        pool.close()
+        pool.join()
\ No newline at end of file